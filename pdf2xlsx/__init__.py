@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
 """
-By default load the managment function and the gui when the module is loaded.
+By default load the managment function when the module is loaded. The gui is
+only imported when it is started, so the package can be used without tkinter.
 """
 from .managment import do_it
-from .gui import main as gui_main
+
+
+def gui_main():
+    """
+    Start the tkinter based gui
+    """
+    from .gui import main
+    main()
+
 # setup
 __version__ = '1.0.0'
-__all__ = ["__main__", "managment", "gui", "logger", "config", "utility", "invoice"]
+__all__ = ["__main__", "managment", "gui", "logger", "config", "utility", "invoice",
+           "cache", "manifest", "cli", "backends"]
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 """
-Fire up the GUI by default
+Fire up the GUI by default, if there are command line arguments run the headless
+command line interface instead
 """
+import sys
+
+if len(sys.argv) > 1:
+    from .cli import main
+    sys.exit(main())
+
 from .gui import main as gui_main
 from .config import init_conf
 
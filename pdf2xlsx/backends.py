@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Text extraction backends. Every backend opens the content of a pdf file and gives
+the text of its pages, the invoice parser only sees the page texts. PyPDF2 is the
+default, the other engines are optional, they are used only if they are installed:
+
+    pip install pdfminer.six PyMuPDF pypdf
+
+The backend is selected by the 'backend' config key. compare_backends() runs every
+available backend over a corpus, so the fastest one which gives the same invoices
+can be chosen (see the compare mode of the command line interface).
+"""
+import time
+from collections import OrderedDict
+from importlib import import_module
+from io import BytesIO, StringIO
+from .config import config
+from .invoice import text_parser
+from .logger import StatLogger
+
+
+class PdfBackend():
+    """
+    Base class of the text extraction backends. The subclasses implement
+    num_pages() and page_text(), the page range and whole document iteration can be
+    overridden if the engine does it faster.
+
+    :param bytes pdf_data: content of the pdf file
+    """
+    name = None
+    module = None
+
+    def __init__(self, pdf_data):
+        self.pdf_data = pdf_data
+
+    @classmethod
+    def available(cls):
+        """
+        :return: True if the engine of the backend is installed
+        :rtype: bool
+        """
+        try:
+            import_module(cls.module)
+        except ImportError:
+            return False
+        return True
+
+    def num_pages(self):
+        """
+        :return: number of the pages of the pdf
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def page_text(self, index):
+        """
+        :param int index: number of the page, starting from 0
+
+        :return: the text of the page
+        :rtype: str
+        """
+        raise NotImplementedError
+
+    def page_range(self, start, stop):
+        """
+        :param int start: number of the first page
+        :param int stop: number of the last page + 1
+
+        :return: the texts of the pages
+        :rtype: list of str
+        """
+        return [self.page_text(index) for index in range(start, stop)]
+
+    def pages(self):
+        """
+        :return: generator of the page texts in the order of the pages
+        :rtype: generator of str
+        """
+        for index in range(self.num_pages()):
+            yield self.page_text(index)
+
+
+class PyPDF2Backend(PdfBackend):
+    """
+    PyPDF2 PdfFileReader and extractText, the default backend
+    """
+    name = 'pypdf2'
+    module = 'PyPDF2'
+
+    def __init__(self, pdf_data):
+        super().__init__(pdf_data)
+        from PyPDF2 import PdfFileReader
+        self.reader = PdfFileReader(BytesIO(pdf_data))
+
+    def num_pages(self):
+        return self.reader.getNumPages()
+
+    def page_text(self, index):
+        return self.reader.getPage(index).extractText()
+
+
+class PypdfBackend(PdfBackend):
+    """
+    pypdf, the maintained successor of PyPDF2
+    """
+    name = 'pypdf'
+    module = 'pypdf'
+
+    def __init__(self, pdf_data):
+        super().__init__(pdf_data)
+        from pypdf import PdfReader
+        self.reader = PdfReader(BytesIO(pdf_data))
+
+    def num_pages(self):
+        return len(self.reader.pages)
+
+    def page_text(self, index):
+        return self.reader.pages[index].extract_text()
+
+
+class PyMuPDFBackend(PdfBackend):
+    """
+    PyMuPDF (fitz), the MuPDF C library
+    """
+    name = 'pymupdf'
+    module = 'fitz'
+
+    def __init__(self, pdf_data):
+        super().__init__(pdf_data)
+        import fitz
+        self.document = fitz.open(stream=pdf_data, filetype='pdf')
+
+    def num_pages(self):
+        return len(self.document)
+
+    def page_text(self, index):
+        return self.document[index].get_text()
+
+
+class PdfMinerBackend(PdfBackend):
+    """
+    pdfminer.six, every page is laid out with the default LAParams. The document is
+    parsed page by page, so the page ranges are not reparsed from the start.
+    """
+    name = 'pdfminer'
+    module = 'pdfminer'
+
+    def _iter_pages(self, pagenos=None):
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        manager = PDFResourceManager()
+        for page in PDFPage.get_pages(BytesIO(self.pdf_data), pagenos=pagenos):
+            text_out = StringIO()
+            device = TextConverter(manager, text_out, laparams=LAParams())
+            PDFPageInterpreter(manager, device).process_page(page)
+            device.close()
+            yield text_out.getvalue()
+
+    def num_pages(self):
+        from pdfminer.pdfpage import PDFPage
+        return sum(1 for _page in PDFPage.get_pages(BytesIO(self.pdf_data)))
+
+    def page_text(self, index):
+        return self.page_range(index, index + 1)[0]
+
+    def page_range(self, start, stop):
+        return list(self._iter_pages(set(range(start, stop))))
+
+    def pages(self):
+        return self._iter_pages()
+
+
+BACKENDS = OrderedDict((backend.name, backend) for backend in
+                       (PyPDF2Backend, PypdfBackend, PyMuPDFBackend, PdfMinerBackend))
+
+
+def available_backends():
+    """
+    :return: names of the installed backends
+    :rtype: list of str
+    """
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+
+def open_pdf(pdf_data, backend=None):
+    """
+    Open the pdf with the given backend
+
+    :param bytes pdf_data: content of the pdf file
+    :param str backend: name of the backend, by default the 'backend' config value
+
+    :return: the opened pdf
+    :rtype: :class:`PdfBackend`
+    """
+    if backend is None:
+        backend = config['backend']['value']
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown pdf backend: {}, choose from: {}".format(
+            backend, ', '.join(BACKENDS)))
+    return backend_cls(pdf_data)
+
+
+def _invoice_values(invoices):
+    return [(invo.to_list(), [tuple(entr.entry_tuple) for entr in invo.entries])
+            for invo in invoices]
+
+
+def compare_backends(pdf_iter, backends=None):
+    """
+    Run the backends over the pdf files, and measure the text extraction and the
+    parsing. The invoices are compared to the ones of the first backend (the
+    reference), a pdf counts as same if every invoice and entry is equal. The
+    lines recognized by the parser are counted as parsed, the lines recorded in the
+    tolerant mode (config) as rejected. The caches are not used.
+
+    :param pdf_iter: Iterable of (name, content) pairs of the pdf files
+    :param list backends: names of the backends, by default the configured one and
+        every other available backend
+
+    :return: backend name -> statistics (pdfs, pages, lines, parsed, rejected, seconds,
+        pages_per_s, invoices, entries, errors, same)
+    :rtype: OrderedDict
+    """
+    if backends is None:
+        default = config['backend']['value']
+        backends = [default] + [name for name in available_backends() if name != default]
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise ValueError("Unknown pdf backend: {}".format(backend))
+    results = OrderedDict((name, dict(pdfs=0, pages=0, lines=0, parsed=0, rejected=0,
+                                      seconds=0.0, invoices=0, entries=0, errors=0, same=0))
+                          for name in backends)
+    for _name, pdf_data in pdf_iter:
+        reference = None
+        for backend in backends:
+            result = results[backend]
+            result['pdfs'] += 1
+            start = time.perf_counter()
+            try:
+                pages = list(open_pdf(pdf_data, backend).pages())
+            except Exception:
+                result['errors'] += 1
+                continue
+            result['seconds'] += time.perf_counter() - start
+            result['pages'] += len(pages)
+            result['lines'] += sum(page.count('\n') + 1 for page in pages)
+
+            logger = StatLogger(profile_regex=True)
+            try:
+                values = _invoice_values(text_parser(pages, logger))
+            except Exception:
+                result['errors'] += 1
+                values = None
+            result['parsed'] += logger.regex.get('LineClassifier.match', {}).get('matches', 0)
+            result['rejected'] += logger.counters['rejects']
+            result['invoices'] += logger.counters['invoices']
+            result['entries'] += logger.counters['entries']
+            if reference is None and backend == backends[0]:
+                reference = values
+            if values is not None and values == reference:
+                result['same'] += 1
+    for result in results.values():
+        result['pages_per_s'] = result['pages'] / result['seconds'] if result['seconds'] else None
+    return results
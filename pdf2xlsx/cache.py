@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressed on-disk caches. There are two layers: the invoice cache stores
+the parsed invoices, the key of a pdf file is the hash of its content and the
+parser version, so a pdf which was already parsed is not opened again. The text
+cache stores the extracted text of the pages, the key is the hash of the pdf
+content only, so a changed parser can run over the cached text without decoding
+the pdf again. The cache directories are limited in size, the least recently used
+files are evicted first.
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+from json import dumps, loads
+from .config import config, init_conf
+from .invoice import invoice_type_names
+
+"""
+Increase it whenever the parsing or the stored classes change, so the old
+cache files are not used anymore
+"""
+CACHE_VERSION = 6
+
+"""
+Increase it whenever the text extraction changes
+"""
+TEXT_CACHE_VERSION = 2
+
+
+class FileCache():
+    """
+    Directory of cache files, every file is named after its key. The size of the
+    cache is tracked, when it exceeds max_size the least recently used files (by
+    modification time, which is updated at every hit) are removed.
+
+    :param str directory: Directory of the cache files
+    :param int max_size: Maximum size of the cache in bytes
+    """
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            #Evicted in the meantime by an other process
+            pass
+
+    def _write(self, key, data):
+        """
+        Write the data to the cache atomically, through a temporary file
+
+        :param str key: Key of the file
+        :param bytes data: Content of the file
+        """
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix='.',
+                                         delete=False) as filedesc:
+            filedesc.write(data)
+        os.replace(filedesc.name, self._path(key))
+        self._stored(key)
+
+    def _stored(self, key):
+        size = os.path.getsize(self._path(key))
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def _files(self):
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        """
+        :return: The size of the cache files in bytes
+        :rtype: int
+        """
+        return sum(size for _mtime, size, _path in self._files())
+
+    def evict(self):
+        """
+        Remove the least recently used files, until the cache size goes below 90% of
+        the max_size.
+        """
+        files = sorted(self._files())
+        self._size = sum(size for _mtime, size, _path in files)
+        limit = self.max_size * 0.9
+        for _mtime, size, path in files:
+            if self._size <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def clear(self):
+        """
+        Remove every file from the cache
+        """
+        for _mtime, _size, path in list(self._files()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+
+class InvoiceCache(FileCache):
+    """
+    Store the invoices parsed from a pdf file in a single file named after the key.
+    The file is a stream of pickled records, every invoice is stored as soon as it is
+    parsed, and the number of entries of the invoices (StatLogger.invo_list) with the
+    number of the read pages closes the stream. A file is only visible
+    in the cache when it was completely written.
+
+    :param str directory: Directory of the cache files
+    :param int max_size: Maximum size of the cache in bytes
+    """
+    def key(self, pdf_data):
+        """
+        Calculate the key of the pdf file. It depends on the content of the pdf, the
+        cache version, the configuration which affects the parsing (ME list, backend)
+        and the registered invoice types
+
+        :param bytes pdf_data: Content of the pdf file
+
+        :return: hexadecimal hash
+        :rtype: str
+        """
+        hasher = hashlib.sha256(pdf_data)
+        hasher.update(dumps([CACHE_VERSION, config['ME']['value'], config['backend']['value'],
+                             invoice_type_names()]).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def load(self, key, logger):
+        """
+        Look up the invoices of the given key.
+
+        :param str key: Key of the pdf file, see key()
+        :param logger: :class:`StatLogger`, the cached invoice and page counts are
+            merged to it
+
+        :return: generator of the cached invoices or None if there is no hit
+        :rtype: generator of :class:`Invoice`
+        """
+        path = self._path(key)
+        try:
+            filedesc = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return self._read(filedesc, logger)
+
+    @staticmethod
+    def _read(filedesc, logger):
+        with filedesc:
+            while True:
+                item = pickle.load(filedesc)
+                if isinstance(item, tuple):
+                    logger.merge_counts(*item)
+                    return
+                yield item
+
+    def store(self, key):
+        """
+        Create a writer to store the invoices of the given key
+
+        :param str key: Key of the pdf file, see key()
+
+        :return: context manager with add(invo) and finish(invo_list, pages) methods
+        :rtype: :class:`CacheWriter`
+        """
+        return CacheWriter(self, key)
+
+
+class TextCache(FileCache):
+    """
+    Store the extracted text of the pages of a pdf file, in a zlib compressed json
+    list. The key only depends on the content of the pdf and the text extraction
+    backend, so the cached text can be reused after the parser was changed.
+
+    :param str directory: Directory of the cache files
+    :param int max_size: Maximum size of the cache in bytes
+    """
+    def key(self, pdf_data):
+        """
+        Calculate the key of the pdf file from its content
+
+        :param bytes pdf_data: Content of the pdf file
+
+        :return: hexadecimal hash
+        :rtype: str
+        """
+        hasher = hashlib.sha256(pdf_data)
+        hasher.update(dumps([TEXT_CACHE_VERSION, config['backend']['value']]).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def load(self, key):
+        """
+        Look up the page texts of the given key.
+
+        :param str key: Key of the pdf file, see key()
+
+        :return: list of the page texts or None if there is no hit
+        :rtype: list of str
+        """
+        try:
+            with open(self._path(key), 'rb') as filedesc:
+                data = filedesc.read()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return loads(zlib.decompress(data).decode('utf-8'))
+
+    def record(self, key, pages):
+        """
+        Pass through the page texts, and store them when every page was read. If the
+        caller stops before the last page nothing is stored.
+
+        :param str key: Key of the pdf file, see key()
+        :param pages: iterable of the page texts
+
+        :return: generator of the page texts
+        :rtype: generator of str
+        """
+        texts = []
+        for text in pages:
+            texts.append(text)
+            yield text
+        self._write(key, zlib.compress(dumps(texts, ensure_ascii=False).encode('utf-8')))
+
+
+class CacheWriter():
+    """
+    Write the invoices of a pdf file to a temporary file, which is moved to its
+    final place by finish(). If the parsing fails, or it is not finished, the
+    temporary file is removed when the context is left.
+
+    :param cache: :class:`InvoiceCache` to store into
+    :param str key: Key of the pdf file
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.filedesc = None
+
+    def __enter__(self):
+        self.filedesc = tempfile.NamedTemporaryFile(dir=self.cache.directory, prefix='.',
+                                                    delete=False)
+        return self
+
+    def add(self, invo):
+        """
+        :param invo: :class:`Invoice` to store
+        """
+        pickle.dump(invo, self.filedesc, pickle.HIGHEST_PROTOCOL)
+
+    def finish(self, invo_list, pages=0):
+        """
+        Close the stream with the invoice and page counts of the pdf and make it visible
+
+        :param list invo_list: number of entries of the invoices (StatLogger.invo_list)
+        :param int pages: number of the pages read from the pdf
+        """
+        pickle.dump((invo_list, pages), self.filedesc, pickle.HIGHEST_PROTOCOL)
+        self.filedesc.close()
+        os.replace(self.filedesc.name, self.cache._path(self.key))
+        self.cache._stored(self.key)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.filedesc.closed:
+            self.filedesc.close()
+            os.remove(self.filedesc.name)
+        return False
+
+
+_CACHES = {}
+
+
+def _get_cache(cache_cls, subdir, size_key):
+    max_size = config[size_key]['value']
+    if not max_size:
+        return None
+    directory = os.path.join(config['cache_dir']['value'], subdir)
+    cache_key = (cache_cls, directory, max_size)
+    if cache_key not in _CACHES:
+        _CACHES[cache_key] = cache_cls(directory, max_size * 1024 * 1024)
+    return _CACHES[cache_key]
+
+
+def get_invoice_cache():
+    """
+    Get the invoice cache set up in the configuration. The cache objects are
+    reused within the process.
+
+    :return: The cache or None if it is switched off (cache_size is 0)
+    :rtype: :class:`InvoiceCache`
+    """
+    return _get_cache(InvoiceCache, 'invoices', 'cache_size')
+
+
+def get_text_cache():
+    """
+    Get the page text cache set up in the configuration. The cache objects are
+    reused within the process.
+
+    :return: The cache or None if it is switched off (text_cache_size is 0)
+    :rtype: :class:`TextCache`
+    """
+    return _get_cache(TextCache, 'text', 'text_cache_size')
+
+
+def _cache_dirs():
+    for subdir in ('invoices', 'text'):
+        directory = os.path.join(config['cache_dir']['value'], subdir)
+        if os.path.isdir(directory):
+            yield directory
+
+
+def clear_cache():
+    """
+    Remove every cached invoice and page text from the configured cache directory,
+    even if the caches are switched off.
+    """
+    for directory in _cache_dirs():
+        FileCache(directory, 0).clear()
+
+
+def main():
+    """
+    Command line interface of the cache: show its size or clear it. The package
+    imports this module, so python warns if it is started with -m, the caches are
+    cleared with ``python -m pdf2xlsx.cli --clear-cache`` instead.
+    """
+    parser = argparse.ArgumentParser(description='Manage the pdf2xlsx caches')
+    parser.add_argument('--clear', action='store_true',
+                        help='remove every cached invoice and page text')
+    args = parser.parse_args()
+    init_conf()
+    if args.clear:
+        clear_cache()
+        print("Cache cleared: {}".format(config['cache_dir']['value']))
+        return
+    size = sum(FileCache(directory, 0).size() for directory in _cache_dirs())
+    print("Cache size: {:.1f} MB in {}".format(size / 1024 / 1024,
+                                               config['cache_dir']['value']))
+
+
+if __name__ == '__main__':
+    main()
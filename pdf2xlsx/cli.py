@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Headless command line interface for batch runs. It never imports tkinter and
+never starts Excel, so it can run on a server e.g. from cron.
+
+    python -m pdf2xlsx.cli -o invoices.xlsx -j 8 day1.zip day2.zip pdf_dir/
+    python -m pdf2xlsx.cli --mode order -o orders.xlsx season.xlsx
+    python -m pdf2xlsx.cli --mode order -o orders.jsonl season.xlsx
+    python -m pdf2xlsx.cli --mode compare --report backends.json corpus.zip
+"""
+import argparse
+import os
+import sys
+from json import dumps
+from .config import config, init_conf
+from .backends import BACKENDS, compare_backends
+from .cache import clear_cache
+from .logger import StatLogger
+from .managment import get_worker_count, iter_pdf_sources, pdfs2xlsx
+from .order_detail_xlsx_parse import (GetOrderDetail, iter_orders, read_xlsx, write_csv,
+                                      write_jsonl, write_xlsx)
+
+
+STREAM_WRITERS = {'.csv': write_csv, '.jsonl': write_jsonl}
+
+
+def parse_args(argv=None):
+    """
+    :param list argv: command line arguments, by default sys.argv[1:]
+
+    :return: the parsed arguments
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='pdf2xlsx', description='Convert invoice pdf files or order detail workbooks to xlsx')
+    parser.add_argument('inputs', nargs='*', metavar='INPUT',
+                        help='zip files, directories or pdf files (invoice mode), '
+                             'order detail xlsx files (order mode)')
+    parser.add_argument('-o', '--output', default=config['xlsx_name']['value'],
+                        help='path of the generated xlsx file, in order mode a .csv or '
+                             '.jsonl output is streamed (default: %(default)s)')
+    parser.add_argument('-m', '--mode', choices=['invoice', 'order', 'compare'],
+                        default='invoice',
+                        help='invoice extraction, order detail conversion or comparison '
+                             'of the pdf text extraction backends')
+    parser.add_argument('--backend', choices=list(BACKENDS),
+                        help='pdf text extraction backend (default: from the config)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes, 0: one per cpu core '
+                             '(default: from the config)')
+    parser.add_argument('--extension', default='.' + config['file_extension']['value'],
+                        help='extension of the pdf files (default: %(default)s)')
+    parser.add_argument('--no-write-only', dest='write_only', action='store_false',
+                        help='build the whole workbook in memory instead of streaming the rows')
+    parser.add_argument('--excel-dates', action='store_true',
+                        help='write the invoice dates as native excel dates instead of text')
+    parser.add_argument('--tolerant', action='store_true',
+                        help='record the bad lines and pdf files in the "rejects" sheet '
+                             'instead of stopping the run')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process new pdf files, and append them to the output')
+    parser.add_argument('--report', help='write the statistics of the run to this json file')
+    parser.add_argument('--profile-regex', action='store_true',
+                        help='measure the time of the line parsing (slower)')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='clear the invoice and page text caches before the run')
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.clear_cache:
+        parser.error('at least one INPUT is required')
+    return args
+
+
+def run_invoices(args):
+    """
+    Extract the invoices of every input to the output xlsx file
+
+    :param argparse.Namespace args: the command line arguments
+
+    :return: the statistics of the run
+    :rtype: :class:`StatLogger`
+    """
+    logger = StatLogger(profile_regex=args.profile_regex)
+    pdfs2xlsx(iter_pdf_sources(args.inputs, args.extension), args.output, logger,
+              workers=args.workers, write_only=args.write_only,
+              incremental=args.incremental)
+    counters = logger.counters
+    print("{pdfs} pdf files, {pages} pages, {invoices} invoices, {entries} entries "
+          "written to {output}".format(output=args.output, **counters))
+    if counters['unknown']:
+        print("{unknown} documents of unknown type were skipped".format(**counters))
+    if counters['rejects']:
+        print("{rejects} lines or pdf files were rejected, see the rejects sheet".format(
+            **counters))
+    return logger
+
+
+def run_orders(args):
+    """
+    Convert the orders of every input order detail workbook to the output file.
+    A csv or JSON Lines output is streamed order by order, for an xlsx output the
+    worksheets of a workbook are parsed in parallel by the workers.
+
+    :param argparse.Namespace args: the command line arguments
+    """
+    writer = STREAM_WRITERS.get(os.path.splitext(args.output)[1].lower())
+    if writer is not None:
+        count = writer((order for path in args.inputs for order in iter_orders(path)),
+                       args.output)
+    else:
+        order_list = []
+        for path in args.inputs:
+            order_list.extend(read_xlsx(GetOrderDetail, path, get_worker_count(args.workers)))
+        write_xlsx(order_list, filename=args.output)
+        count = len(order_list)
+    print("{} orders written to {}".format(count, args.output))
+
+
+def run_compare(args):
+    """
+    Run every available text extraction backend over the input pdf files, and print
+    their speed and parse results
+
+    :param argparse.Namespace args: the command line arguments
+
+    :return: backend name -> statistics, see backends.compare_backends
+    :rtype: OrderedDict
+    """
+    results = compare_backends(iter_pdf_sources(args.inputs, args.extension))
+    print("{:10} {:>6} {:>7} {:>9} {:>8} {:>8} {:>9} {:>8} {:>6} {:>5}".format(
+        'backend', 'pdfs', 'pages', 'pages/s', 'parsed', 'rejected', 'invoices', 'entries',
+        'errors', 'same'))
+    for name, result in results.items():
+        print("{name:10} {pdfs:6d} {pages:7d} {speed:9.1f} {parsed:8d} {rejected:8d} "
+              "{invoices:9d} {entries:8d} {errors:6d} {same:5d}".format(
+                  name=name, speed=result['pages_per_s'] or 0.0, **result))
+    return results
+
+
+def main(argv=None):
+    """
+    Entry point of the command line interface
+
+    :param list argv: command line arguments, by default sys.argv[1:]
+
+    :return: exit code
+    :rtype: int
+    """
+    init_conf()
+    args = parse_args(argv)
+    if args.clear_cache:
+        clear_cache()
+    if args.excel_dates:
+        config['excel_dates']['value'] = 1
+    if args.backend:
+        config['backend']['value'] = args.backend
+    if args.tolerant:
+        config['tolerant']['value'] = 1
+    if not args.inputs:
+        return 0
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if args.mode == 'order':
+        run_orders(args)
+        return 0
+    if args.mode == 'compare':
+        results = run_compare(args)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as report_out:
+                report_out.write(dumps(results, indent=4))
+        return 0
+
+    logger = run_invoices(args)
+    if args.report:
+        logger.to_json(args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
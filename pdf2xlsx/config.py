@@ -3,7 +3,8 @@
 Configuration structure, loading and storing
 """
 from json import dumps, loads
-from collections import OrderedDict, Mapping
+from collections import OrderedDict
+from collections.abc import Mapping
 import os
 
 
@@ -67,6 +68,17 @@ config = JsonDict([
     ('xlsx_name', _create_dict(['invoices.xlsx', 'xlsx name', 'Entry', False])),
     ('invo_header_ident', _create_dict([[1, 2, 3, 4], 'invo header pos', 'Entry', False])),
     ('ME', _create_dict([['Pár', 'Darab'], 'Me category', 'Entry', True])),
+    ('workers', _create_dict([0, 'worker processes (0: auto)', 'Entry', True])),
+    ('backend', _create_dict(['pypdf2', 'pdf text backend', 'Entry', True])),
+    ('split_pages', _create_dict([256, 'split pdf pages from (0: off)', 'Entry', True])),
+    ('cache_dir', _create_dict(
+        [os.path.join(HOME, '.pdf2xlsx', 'cache'), 'cache dir', 'Entry', True])),
+    ('cache_size', _create_dict([256, 'cache size MB (0: off)', 'Entry', True])),
+    ('text_cache_size', _create_dict([1024, 'text cache size MB (0: off)', 'Entry', True])),
+    ('excel_dates', _create_dict([0, 'native excel dates (0: text)', 'Entry', True])),
+    ('compact_entries', _create_dict([1, 'compact entry storage (0: off)', 'Entry', True])),
+    ('tolerant', _create_dict([0, 'skip the bad lines and pdfs (0: off)', 'Entry', True])),
+    ('order_scales', _create_dict([[], 'order size scales ([]: built-in)', 'Entry', False])),
     ('excel_path', _create_dict(
         [r'C:\Program Files (x86)\Microsoft Office\Office14\excel.exe', 'Excel:', 'filedialog',
          True])),
@@ -7,6 +7,9 @@ import os
 import shutil
 from .managment import do_it, do_it2
 from .config import config
+from .cache import clear_cache
+from .invoice import clear_me_units
+from .order_detail_xlsx_parse import clear_scale_indexes
 
 __version__ = '0.2.0'
 
@@ -103,6 +106,9 @@ class ConfigWindow:
         ttk.Button(self.main_frame, text='Accept',
                    command=self.accept_callback).grid(row=row, column=1, sticky='w')
 
+        ttk.Button(self.main_frame, text='Clear cache',
+                   command=self.clear_cache_callback).grid(row=row, column=1, sticky='e')
+
     def save_callback(self):
         """
         Hides the ConfigWindow and updates and stores the configuration
@@ -118,6 +124,15 @@ class ConfigWindow:
         for conf in self.conf_list:
             conf.update_config()
         config.store()
+        clear_me_units()
+        clear_scale_indexes()
+
+    def clear_cache_callback(self):
+        """
+        Remove every cached invoice and page text from the cache directory
+        """
+        clear_cache()
+        messagebox.showinfo(title='Cache', message='The caches have been cleared')
 
     def _on_closing(self):
         self.window.withdraw()
@@ -4,47 +4,594 @@ Classes for different invoce types
 """
 
 import re
+from array import array
 from collections import namedtuple
-from datetime import datetime
+from sys import intern
 from .config import config
-from .utility import list2row
+from .utility import list2row, list2values, parse_date, format_date
+
+class ParseError(AttributeError):
+    """
+    A line of the pdf text could not be parsed. It is an AttributeError, as the
+    failed regex matches raised it before, so the old handlers still catch it.
+
+    :param str reason: What went wrong
+    :param str line: The line which could not be parsed
+    """
+    def __init__(self, reason, line):
+        super().__init__(reason, line)
+        self.reason = reason
+        self.line = line
+
+    def __str__(self):
+        return '{}: {}'.format(self.reason, self.line)
+
+_INVOICE_TYPES = {}
+#The signatures in one alternation, the longest first, see title_pattern()
+_TITLE_PATTERN = [None]
+
+def register_invoice_type(signatures, invo_cls, entry_cls):
+    """
+    Register an invoice type. The documents whose title line starts with one of
+    the signatures are parsed with the given invoice and entry classes. The
+    signatures are stored in a prefix trie, see get_invo_type, and in the title
+    alternation of the line classifier, see title_pattern
+
+    :param signatures: iterable of the title prefixes, e.g. ('SZÁMLA',)
+    :param invo_cls: :class:`Invoice` class (or subclass)
+    :param entry_cls: :class:`Entry` class (or subclass)
+    """
+    for signature in signatures:
+        node = _INVOICE_TYPES
+        for char in signature:
+            node = node.setdefault(char, {})
+        node[None] = (invo_cls, entry_cls)
+    _TITLE_PATTERN[0] = None
+
+def title_pattern():
+    """
+    :return: the pattern of the title lines of the registered invoice types, the
+        longer signatures are tried first, like in get_invo_type
+    :rtype: str
+    """
+    if _TITLE_PATTERN[0] is None:
+        signatures = [signature for signature, _types in _registered_types()]
+        _TITLE_PATTERN[0] = '|'.join(re.escape(signature) for signature in
+                                     sorted(signatures, key=len, reverse=True))
+    return _TITLE_PATTERN[0]
+
+def _registered_types():
+    types = []
+    stack = [('', _INVOICE_TYPES)]
+    while stack:
+        prefix, node = stack.pop()
+        for char, child in node.items():
+            if char is None:
+                types.append((prefix, child))
+            else:
+                stack.append((prefix + char, child))
+    return types
+
+def invoice_type_names():
+    """
+    :return: the registered signatures with the names of their invoice and entry
+        classes, sorted by the signature (e.g. for the key of the invoice cache)
+    :rtype: list of list of str
+    """
+    return sorted([signature] + ['{}.{}'.format(cls.__module__, cls.__qualname__)
+                                 for cls in types]
+                  for signature, types in _registered_types())
 
 def get_invo_type(pdf_line):
     """
-    TODO add title parse to decide between invoce types
+    Look up the invoice type of the title line in the registered signatures. The
+    line is walked once along the prefix trie, the longest matching signature wins.
+
+    :param str pdf_line: The line to check
+
+    :return: the invoice and entry classes, None if the line is not a known title
+    :rtype: tuple of (class, class)
+    """
+    node = _INVOICE_TYPES
+    found = None
+    for char in pdf_line:
+        node = node.get(char)
+        if node is None:
+            break
+        found = node.get(None, found)
+    return found
+
+def pdf_pages(pdf_file):
+    """
+    Extract the text of the pages of the pdf one by one
+
+    :param PdfFileReader pdf_file: The pdf to read
+
+    :return: generator of the page texts
+    :rtype: generator of str
     """
-    if pdf_line.startswith('HELYESB') or pdf_line.startswith('VISSZÁRU'):
-        return CreditInvoice, CreditEntry
-    if pdf_line.startswith('SZÁMLA'):
-        return Invoice, Entry
-    return None
+    for i in range(pdf_file.getNumPages()):
+        yield pdf_file.getPage(i).extractText()
 
 def invo_parser(pdf_file, logger):
     """
-    Factory to generate the apropriate invoce type based on the title in the PDF
+    Factory to generate the apropriate invoce type based on the title in the PDF.
+    The parsed invoice is yielded, so the caller can process it immediately. The
+    title has to be on the first page, if no registered invoice type was found there
+    the document is skipped (counted as unknown by the logger), and nothing is
+    yielded.
+
+    :param PdfFileReader pdf_file: The pdf to parse
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+
+    :return: generator of the invoices found in the pdf
+    :rtype: generator of :class:`Invoice`
+    """
+    return text_parser(pdf_pages(pdf_file), logger)
+
+def text_parser(pages, logger):
+    """
+    Parse the already extracted text of the pages, see invo_parser. A document may
+    contain several invoices: a new invoice number line (id_no rule) with a
+    different number closes the current invoice, and the parsing goes on with a
+    fresh invoice of the type of the last title line. The closed invoices are
+    yielded after the page is parsed, so only the invoices of the current page are
+    kept in memory.
+    Every line is matched once by the rule of the current state (see
+    :class:`LineClassifier`), only the rare title and invoice number lines are
+    checked again one by one.
+    In tolerant mode (config) a :class:`ParseError` does not stop the parsing, it
+    is recorded by logger.reject(). An entry which could not be parsed is dropped,
+    an invoice whose header could not be parsed is dropped until the next invoice
+    starts.
+
+    :param pages: iterable of the page texts
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+
+    :return: generator of the invoices found in the text
+    :rtype: generator of :class:`Invoice`
     """
-    invoice_type_found = False
-    invo_cls = Invoice
-    entry_cls = Entry
     invo = None
     entry = None
-    for i in range(pdf_file.getNumPages()):
-        for line in pdf_file.getPage(i).extractText().split('\n'):
-            if invoice_type_found:
-                if invo.parse_line(line):
-                    logger.new_invo()
-                if entry.parse_line(line):
-                    invo.entries.append(entry)
-                    entry = entry_cls(invo=invo)
-                    logger.new_entr()
-            else:
-                tmp = get_invo_type(line)
-                if get_invo_type(line):
-                    invoice_type_found = True
-                    invo_cls, entry_cls = tmp
-                    invo = invo_cls(entries=list())
-                    entry = entry_cls(invo=invo)
-    return invo
+    classifier = None
+    #The classifier of the last title line, the next invoice is of its type
+    next_classifier = None
+    state = None
+    profile = logger.profile_regex
+    compact = config['compact_entries']['value']
+    tolerant = config['tolerant']['value']
+    #The header of the current invoice could not be parsed, it is dropped
+    skipping = False
+    #The entry waits for its second line
+    waiting = False
+    #The rules of the current state without and with a waiting entry, None when the
+    #state was changed
+    rules = None
+    rule_free = rule_waiting = strict = None
+    closed = []
+    for page_no, page in enumerate(pages, 1):
+        with logger.stage('parse'):
+            for line in page.split('\n'):
+                if rules is None:
+                    rules = LineClassifier.rules(invo, classifier, next_classifier, state,
+                                                 skipping)
+                    rule_free, rule_waiting = rules
+                    strict = rule_free.strict
+                match, _, first, spaced = rule_waiting if waiting else rule_free
+                #The lines which can not match are not passed to the regex engine
+                if first is not None and not (
+                        line[:1] in first or
+                        line[:1] == ' ' and line.lstrip(' ')[:1] in spaced):
+                    matchob = None
+                elif profile:
+                    matchob = logger.timed_call('LineClassifier.match', match, line)
+                else:
+                    matchob = match(line)
+                kind = None if matchob is None else matchob.lastgroup
+
+                if kind == 'title' or kind == 'start':
+                    #Rare lines, the checks are done one by one
+                    if kind == 'title':
+                        next_classifier = LineClassifier.get(*get_invo_type(line))
+                        rules = None
+                        if invo is None:
+                            classifier = next_classifier
+                            invo, entry = classifier.new_invoice(compact)
+                            state = invo.parse_state()
+                            continue
+                    if invo.id_no_parsed or skipping:
+                        id_groups = next_classifier.invoice_start(line)
+                        if id_groups is not None:
+                            new_invo, new_entry = next_classifier.new_invoice(compact)
+                            new_invo.consume('id_no', id_groups)
+                            if skipping or new_invo.id_no != invo.id_no:
+                                if not skipping:
+                                    closed.append(invo)
+                                skipping = waiting = False
+                                classifier = next_classifier
+                                invo, entry = new_invo, new_entry
+                                state = invo.parse_state()
+                                rules = None
+                                logger.new_invo()
+                                continue
+                    if skipping:
+                        continue
+                    #Classify the line as any other line of the state
+                    matchob = classifier.rule(state, waiting, title=False).match(line)
+                    kind = None if matchob is None else matchob.lastgroup
+
+                if kind == 'code':
+                    entry.begin(matchob)
+                    waiting = True
+                    continue
+                if kind == 'invo':
+                    first = matchob.re.groupindex['invo']
+                    groups = matchob.groups()[first:first + invo.LINE_CMPS[state].groups]
+                    if invo.consume(state, groups):
+                        logger.new_invo()
+                    state = invo.parse_state()
+                    rules = None
+                    if not waiting:
+                        #The line may also start with an entry code, check it separately
+                        code_match = entry.CODE_CMP.match(line)
+                        if code_match:
+                            entry.begin(code_match)
+                            waiting = True
+                        continue
+                elif strict:
+                    if not tolerant:
+                        classifier.no_match(line, state)
+                    logger.reject("{} pattern of {} didn't match".format(
+                        state, classifier.invo_cls.__name__), line, page_no)
+                    if invo.id_no_parsed:
+                        logger.drop_invo()
+                    skipping = True
+                    waiting = False
+                    rules = None
+                    continue
+                if waiting:
+                    try:
+                        if profile:
+                            entry_parsed = logger.timed_call('Entry.parse_line',
+                                                             entry.parse_line, line)
+                        else:
+                            entry_parsed = entry.parse_line(line)
+                    except ParseError as exc:
+                        if not tolerant:
+                            raise
+                        logger.reject(exc.reason, exc.line, page_no)
+                        entry = classifier.entry_cls(invo=invo)
+                        waiting = False
+                        continue
+                    if entry_parsed:
+                        invo.entries.append(entry)
+                        entry = classifier.entry_cls(invo=invo)
+                        waiting = False
+                        logger.new_entr()
+        if invo is None:
+            #The rest of the pages of an unknown document are not extracted
+            logger.unknown_document()
+            return
+        yield from closed
+        closed.clear()
+    if invo is not None and not skipping:
+        yield invo
+
+#The compiled rule of a parse state. A line is matched only if its first character
+#is in first, or it starts with spaces followed by a character in spaced (the
+#leading spaces themselves are not in first), the other lines can not match, see
+#first_chars(). first and spaced are None if the rule is not gated.
+LineRule = namedtuple('LineRule', ['match', 'strict', 'first', 'spaced'])
+
+#A gate which lets through more first characters than this (e.g. the [A-Z0-9] of the
+#entry code) passes most lines, it costs more than the regex fails it saves
+_MAX_GATE_CHARS = 16
+
+def _class_chars(body):
+    chars = set()
+    i = 0
+    while i < len(body):
+        if i + 2 < len(body) and body[i + 1] == '-':
+            chars.update(chr(code) for code in range(ord(body[i]), ord(body[i + 2]) + 1))
+            i += 3
+        else:
+            chars.add(body[i])
+            i += 1
+    return chars
+
+def _start_alternation(pattern, groups):
+    #Is there a | which is an alternative of the whole pattern, or of one of the
+    #groups opened at its start
+    outer = groups
+    depth = 0
+    in_class = escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            outer = min(outer, depth)
+        elif char == '|' and depth <= outer:
+            return True
+    return False
+
+def first_chars(pattern):
+    """
+    Tell the characters a match of the pattern can start with. Only the simple
+    forms of the line patterns are understood: optional leading spaces ([ ]*),
+    opening groups, then a literal character, an escaped character or a character
+    class, which is not optional.
+
+    :param str pattern: The regex pattern
+
+    :return: the possible first characters, and whether they may follow leading
+        spaces, None if the pattern is not understood (e.g. it starts with .*)
+    :rtype: tuple of (frozenset, bool)
+    """
+    spaced = pattern.startswith('[ ]*')
+    rest = pattern[4:] if spaced else pattern
+    groups = 0
+    while rest.startswith('('):
+        if rest.startswith('(?P<'):
+            rest = rest[rest.index('>') + 1:]
+        elif rest.startswith('(?:'):
+            rest = rest[3:]
+        elif rest.startswith('(?'):
+            return None
+        else:
+            rest = rest[1:]
+        groups += 1
+    if _start_alternation(pattern, groups):
+        return None
+    if rest.startswith('\\'):
+        char = rest[1:2]
+        if not char or char.isalnum():
+            return None
+        chars, rest = {char}, rest[2:]
+    elif rest.startswith('['):
+        end = rest.find(']', 2)
+        body = rest[1:end]
+        if end < 0 or body.startswith('^') or '\\' in body or '[' in body:
+            return None
+        chars, rest = _class_chars(body), rest[end + 1:]
+    elif rest and rest[0] not in '.^$|()*+?{}':
+        chars, rest = {rest[0]}, rest[1:]
+    else:
+        return None
+    if rest[:1] in ('?', '*') or rest.startswith('{0') or rest.startswith('{,'):
+        return None
+    return frozenset(chars), spaced
+
+def title_first_chars():
+    """
+    :return: the first characters of the registered title signatures, None if a
+        signature is empty
+    :rtype: frozenset
+    """
+    if None in _INVOICE_TYPES:
+        return None
+    return frozenset(_INVOICE_TYPES)
+
+def gate_rule(match, strict, gates):
+    """
+    Create the rule of the alternatives, gated by their first characters if they
+    are known and few
+
+    :param match: The match method of the compiled alternation
+    :param bool strict: The rule is strict, see :class:`Invoice`
+    :param gates: iterable of the first_chars() of the alternatives
+
+    :return: The rule
+    :rtype: :class:`LineRule`
+    """
+    first = set()
+    spaced = set()
+    for gate in gates:
+        if gate is None:
+            return LineRule(match, strict, None, None)
+        chars, leading_spaces = gate
+        first.update(chars)
+        if leading_spaces:
+            spaced.update(chars)
+    if len(first | spaced) > _MAX_GATE_CHARS:
+        return LineRule(match, strict, None, None)
+    return LineRule(match, strict, frozenset(first), frozenset(spaced))
+
+class LineClassifier():
+    """
+    Single pass classifier of the lines for the Invoice and Entry state machines.
+    For every parse state of the invoice the title signatures, the invoice number
+    of the next invoice, the pattern of the state and the entry code pattern are
+    compiled into one alternation with named groups (title, start, invo, code), so
+    a line is matched once, and the lines which match none of them are rejected by
+    the regex engine. The rules are compiled on demand and shared, see get() and
+    rule().
+
+    :param invo_cls: :class:`Invoice` class (or subclass) with LINE_RULES
+    :param entry_cls: :class:`Entry` class (or subclass) with CODE_PATTERN
+    """
+    _classifiers = {}
+    #The rule of the lines before the first title, only the title is searched
+    _title_rules = {}
+
+    def __init__(self, invo_cls, entry_cls):
+        self.invo_cls = invo_cls
+        self.entry_cls = entry_cls
+        self._rules = {}
+
+    @classmethod
+    def get(cls, invo_cls, entry_cls):
+        """
+        Get the shared classifier of the invoice and entry classes
+
+        :return: The classifier
+        :rtype: :class:`LineClassifier`
+        """
+        key = (invo_cls, entry_cls)
+        if key not in cls._classifiers:
+            cls._classifiers[key] = cls(invo_cls, entry_cls)
+        return cls._classifiers[key]
+
+    @classmethod
+    def rules(cls, invo, classifier, next_classifier, state, skipping):
+        """
+        Get the rules of the current state of the text parser, see text_parser
+
+        :param invo: The current :class:`Invoice`, None before the first title
+        :param classifier: The classifier of the current invoice
+        :param next_classifier: The classifier of the last title line
+        :param str state: The parse state of the invoice
+        :param bool skipping: The current invoice is dropped, only the next invoice
+            is searched
+
+        :return: the rules without and with a waiting entry
+        :rtype: tuple of (:class:`LineRule`, :class:`LineRule`)
+        """
+        if invo is None:
+            title = title_pattern()
+            rule = cls._title_rules.get(title)
+            if rule is None:
+                chars = title_first_chars()
+                rule = cls._title_rules[title] = gate_rule(
+                    re.compile('(?P<title>{})'.format(title)).match, False,
+                    [None if chars is None else (chars, False)])
+            return rule, rule
+        if skipping:
+            rule = classifier.rule(None, True, next_classifier)
+            return rule, rule
+        start = next_classifier if invo.id_no_parsed else None
+        return classifier.rule(state, False, start), classifier.rule(state, True, start)
+
+    def rule(self, state, entry_waiting, start=None, title=True):
+        """
+        Get the compiled rule of the invoice parse state
+
+        :param str state: The parse state of the invoice, see Invoice.parse_state
+        :param bool entry_waiting: The entry waits for its second line, so the entry
+            code is not searched
+        :param start: :class:`LineClassifier` of the next invoice, its invoice number
+            line starts a new invoice. None if it is not searched.
+        :param bool title: Search the title lines
+
+        :return: The rule
+        :rtype: :class:`LineRule`
+        """
+        titles = title_pattern() if title else None
+        key = (state, entry_waiting, start, titles)
+        rule = self._rules.get(key)
+        if rule is None:
+            rule = self._rules[key] = self._compile(state, entry_waiting, start, titles)
+        return rule
+
+    def _compile(self, state, entry_waiting, start, titles):
+        pattern, strict = self.invo_cls.LINE_RULES.get(state, (None, False))
+        alternatives = []
+        gates = []
+        if titles:
+            alternatives.append('(?P<title>{})'.format(titles))
+            chars = title_first_chars()
+            gates.append(None if chars is None else (chars, False))
+        if start is not None:
+            alternatives.append('(?P<start>{})'.format(start.invo_cls.ID_NO_PATTERN))
+            gates.append(first_chars(start.invo_cls.ID_NO_PATTERN))
+        if pattern is not None:
+            alternatives.append('(?P<invo>{})'.format(pattern))
+            gates.append(first_chars(pattern))
+        if not entry_waiting:
+            alternatives.append('(?P<code>{})'.format(self.entry_cls.CODE_PATTERN))
+            gates.append(first_chars(self.entry_cls.CODE_PATTERN))
+        return gate_rule(re.compile('|'.join(alternatives) or '(?!)').match, strict, gates)
+
+    def new_invoice(self, compact=False):
+        """
+        Create an empty invoice and its first entry
+
+        :param bool compact: Store the entries in :class:`EntryColumns`
+
+        :return: the invoice and the entry
+        :rtype: tuple of (:class:`Invoice`, :class:`Entry`)
+        """
+        invo = self.invo_cls(entries=list())
+        if compact:
+            invo.entries = EntryColumns(invo, self.entry_cls.CODE_WIDTH)
+        return invo, self.entry_cls(invo=invo)
+
+    def invoice_start(self, line):
+        """
+        Check whether the line starts a new invoice, i.e. it matches the id_no rule of
+        the invoice class
+
+        :param str line: The line to check
+
+        :return: the groups of the id_no rule, None if the line does not start an
+            invoice
+        :rtype: tuple
+        """
+        matchob = self.invo_cls.LINE_CMPS['id_no'].match(line)
+        if matchob is None:
+            return None
+        return matchob.groups()
+
+    def no_match(self, line, state):
+        """
+        The line did not match the strict rule of the state
+
+        :raises ParseError: always
+        """
+        raise ParseError("{} pattern of {} didn't match".format(
+            state, self.invo_cls.__name__), line)
+
+#The entry classes whose ME units are cached, see get_me_units()
+_ME_UNIT_CLASSES = set()
+
+def get_me_units(entry_cls):
+    """
+    Get the ME units of the entry class. They are read from the config once and
+    cached on the class, so creating an entry does not touch the config, see also
+    clear_me_units()
+
+    :param entry_cls: :class:`Entry` class (or subclass)
+
+    :return: the ME units, shortest first so the name is as long as possible
+    :rtype: tuple of str
+    """
+    units = tuple(sorted(config['ME']['value'], key=len))
+    entry_cls._me_units = units
+    _ME_UNIT_CLASSES.add(entry_cls)
+    return units
+
+def clear_me_units():
+    """
+    Drop the cached ME units, they are read from the config again on demand. It
+    should be called when the config is updated.
+    """
+    for entry_cls in _ME_UNIT_CLASSES:
+        entry_cls._me_units = None
+    _ME_UNIT_CLASSES.clear()
+
+def columns_cmp(sign):
+    """
+    Compile the pattern of the numeric columns of the entry lines, the six tokens
+    after the ME joined with single spaces: INTEGER INTEGER-. INTEGER% INTEGER-.
+    INTEGER-. INTEGER%, the VAT% may be followed by anything but white space.
+
+    :param str sign: The sign at the end of the prices e.g. - of the credit entries
+
+    :return: the compiled pattern
+    :rtype: re.Pattern
+    """
+    price = r'([0-9]+\.?[0-9]*)' + re.escape(sign)
+    total = r'([0-9]+\.?[0-9]*\.?[0-9]*)' + re.escape(sign)
+    return re.compile(' '.join(['([0-9]+)', price, '([0-9]+)%', price, total,
+                                r'([0-9]+)%\S*']))
 
 EntryTuple = namedtuple('EntryTuple', ['kod', 'nev', 'ME', 'mennyiseg', 'BEgysegar',
                                        'Kedv', 'NEgysegar', 'osszesen', 'AFA'])
@@ -83,6 +630,15 @@ class Invoice():
     AWKWARD_DATE_PATTERN = r'([0-9]{2})\.([0-9]{2})\.([0-9]{4})'
     AWKWARD_DATE_CMP = re.compile(AWKWARD_DATE_PATTERN)
 
+    #The rules of the parse states: the pattern and whether the line must match
+    LINE_RULES = {'id_no': (ID_NO_PATTERN, False),
+                  'orig_date': (ORIG_DATE_PATTERN, False),
+                  'pay_due': (PAY_DUE_PATTERN, False)}
+    LINE_CMPS = {'id_no': ID_NO_CMP, 'orig_date': ORIG_DATE_CMP, 'pay_due': PAY_DUE_CMP}
+
+    __slots__ = ('id_no', 'orig_date', 'pay_due', 'total_sum', 'entries',
+                 'id_no_parsed', 'orig_date_parsed', 'pay_due_parsed')
+
     def __init__(self, no=0, orig_date="", pay_due="", total_sum=0, entries=None):
         self.id_no = no
         self.orig_date = orig_date
@@ -96,28 +652,26 @@ class Invoice():
 
     def __str__(self):
         tmp_str = '\n    '.join([str(entr) for entr in self.entries])
-        return ('Sorszam: {id_no}, Kelt: {orig_date}, Fizetesihatarido: {pay_due},'
-                'Vegosszeg: {total_sum}\nBejegyzesek:\n    {entry_list}'
-                '').format(**self.__dict__, entry_list=tmp_str)
+        return ('Sorszam: {0.id_no}, Kelt: {0.orig_date}, Fizetesihatarido: {0.pay_due},'
+                'Vegosszeg: {0.total_sum}\nBejegyzesek:\n    {entry_list}'
+                '').format(self, entry_list=tmp_str)
 
     def __repr__(self):
-        return ('{__class__.__name__}(no={no!r},orig_date={orig_date!r},'
-                'pay_due={pay_due!r},total_sum={total_sum!r},'
-                'entries={entries!r})').format(__class__=self.__class__, **self.__dict__)
+        return ('{0.__class__.__name__}(no={0.id_no!r},orig_date={0.orig_date!r},'
+                'pay_due={0.pay_due!r},total_sum={0.total_sum!r},'
+                'entries={entries!r})').format(self, entries=list(self.entries))
 
     def _normalize_str_date(self, strdate):
         """
         The date is represented in two different format in the pdf: YYYY.MM.DD and
-        DD.MM.YYYY. The second needs to be converted to the first one.
+        DD.MM.YYYY. Both of them are parsed to datetime, see utility.parse_date
 
         :param str strdate: string representation of the parsed date to normalize
 
         :return: the normalized date
         :rtype: datetime
         """
-        if self.AWKWARD_DATE_CMP.match(strdate):
-            return datetime.strptime(strdate, '%d.%m.%Y')
-        return datetime.strptime(strdate, '%Y.%m.%d')
+        return parse_date(strdate)
 
     def parse_line(self, line):
         """
@@ -131,37 +685,77 @@ class Invoice():
         FIZETÉSI HATÁRIDŐ:(YYYY.MM.DD|DD.MM.YYYY) (NNN[.NNN.NNN])
         <disinterested rubish>
         This is structure is paresed using the three state variable, and stored inside
-        the class attributes
+        the class attributes. The rule of the current state is given by parse_state(),
+        the matched groups are stored by consume().
 
         :param str line: The actual line to parse
 
         :return: True when the parsing of the Invoice was started
         :rtype: bool
         """
+        state = self.parse_state()
+        if state is None:
+            return False
+        matchob = self.LINE_CMPS[state].match(line)
+        if matchob is None:
+            if self.LINE_RULES[state][1]:
+                raise ParseError("{} pattern of {} didn't match".format(
+                    state, self.__class__.__name__), line)
+            return False
+        return self.consume(state, matchob.groups())
+
+    def parse_state(self):
+        """
+        The current parse state, it is the key of the LINE_RULES to check the next
+        line with.
+
+        :return: name of the state, None when everything was parsed
+        :rtype: str
+        """
         if not self.id_no_parsed:
-            matchob = self.ID_NO_CMP.match(line)
-            if matchob:
-                self.id_no = int(matchob.group(1))
-                self.id_no_parsed = True
-                return True
-
-        elif not self.orig_date_parsed:
-            matchob = self.ORIG_DATE_CMP.match(line)
-            if matchob:
-                self.orig_date = self._normalize_str_date(matchob.group(1))
-                self.orig_date_parsed = True
-                return False
+            return 'id_no'
+        if not self.orig_date_parsed:
+            return 'orig_date'
+        if not self.pay_due_parsed:
+            return 'pay_due'
+        return None
 
-        elif not self.pay_due_parsed:
-            matchob = self.PAY_DUE_CMP.match(line)
-            if matchob:
-                self.pay_due = self._normalize_str_date(matchob.group(1))
-                self.total_sum = int(matchob.group(2).replace('.', ''))
-                self.pay_due_parsed = True
-                return False
+    def consume(self, state, groups):
+        """
+        Store the groups matched by the rule of the state, and step to the next state
+
+        :param str state: The parse state, see parse_state()
+        :param tuple groups: The groups of the matched pattern
 
+        :return: True when the parsing of the Invoice was started
+        :rtype: bool
+        """
+        if state == 'id_no':
+            self.id_no = int(groups[0])
+            self.id_no_parsed = True
+            return True
+        if state == 'orig_date':
+            self.orig_date = self._normalize_str_date(groups[0])
+            self.orig_date_parsed = True
+        elif state == 'pay_due':
+            self.pay_due = self._normalize_str_date(groups[0])
+            self.total_sum = int(groups[1].replace('.', ''))
+            self.pay_due_parsed = True
         return False
 
+    def to_list(self):
+        """
+        Collect the invoice information which is written to the xlsx file. The dates
+        are YYYY.MM.DD strings, or native Excel dates if excel_dates is configured.
+
+        :return: the values to write out
+        :rtype: list
+        """
+        if config['excel_dates']['value']:
+            return [self.id_no, self.orig_date.date(), self.pay_due.date(), self.total_sum]
+        return [self.id_no, format_date(self.orig_date), format_date(self.pay_due),
+                self.total_sum]
+
     def xlsx_write(self, worksheet, row, col):
         """
         Write the invoice information to a template xlsx file.
@@ -173,12 +767,19 @@ class Invoice():
         :return: the next position of cursor row,col
         :rtype: tuple of (int,int)
         """
-        values = [self.id_no, datetime.strftime(self.orig_date, '%Y.%m.%d'),
-                  datetime.strftime(self.pay_due, '%Y.%m.%d'), self.total_sum]
         positions = config['invo_header_ident']['value']
-        row, col = list2row(worksheet, row, col, values, positions)
+        row, col = list2row(worksheet, row, col, self.to_list(), positions)
         return row, col
 
+    def xlsx_append(self, worksheet):
+        """
+        Append the invoice information as a whole row to a (write-only) worksheet.
+
+        :param Worksheet worksheet: Worksheet class to write info
+        """
+        positions = config['invo_header_ident']['value']
+        worksheet.append(list2values(self.to_list(), positions))
+
 
 class Entry():
     """
@@ -186,15 +787,26 @@ class Entry():
     stored in the EntryTuple namedtuple. The parsing is contolled by a state
     variable (:entry_found:) Because the invoice entries are split into two line,
     the tmp_str attribute is used to store the first part of the entire
-    The ME values are configurable, so they cannot be created at class level, they
-    need to be recomputed at evry instantiation
+    The ME values are configurable, so they are read from the config when the first
+    entry is parsed and cached on the class, see get_me_units()
 
     :param EntryTuple entry_tuple: The invoice entry
     :param Invoice invo: The parent invoice containing this entry
     """
 
-    CODE_PATTERN = '[ ]*([A-Z0-9]{2}[0-9]{4}-[0-9]{3})'
+    CODE_PATTERN = '[ ]*(?P<kod>[A-Z0-9]{2}[0-9]{4}-[0-9]{3})'
     CODE_CMP = re.compile(CODE_PATTERN)
+    #The length of the ascii codes of CODE_PATTERN, they are packed by EntryColumns.
+    #None if the codes are not of fixed width.
+    CODE_WIDTH = 10
+
+    #The numeric columns at the end of the line, see columns_cmp()
+    SIGN = ''
+    COLUMNS_CMP = columns_cmp(SIGN)
+    #The ME units of the config, see get_me_units()
+    _me_units = None
+
+    __slots__ = ('entry_tuple', 'invo', 'entry_found', 'tmp_str', 'multiplyer', 'code_match')
 
     def __init__(self, entry_tuple=None, invo=None):
         self.entry_tuple = entry_tuple
@@ -202,26 +814,15 @@ class Entry():
 
         self.entry_found = False
         self.tmp_str = ""
-
-        self.me_pattern = "".join(['(', "|".join(config['ME']['value']), ')'])
-        self.entry_pattern = "".join([self.CODE_PATTERN,  #termek kod
-                                      "(.*)", #termek megnevezes
-                                      self.me_pattern, # ME
-                                      "[ ]+([0-9]+)", # mennyiseg
-                                      r"[ ]+([0-9]+\.?[0-9]*)", # Brutto Egysegar
-                                      "[ ]+([0-9]+)%", # Kedvezmeny
-                                      r"[ ]+([0-9]+\.?[0-9]*)", # Netto Egysegar
-                                      r"[ ]+([0-9]+\.?[0-9]*\.?[0-9]*)", # Osszesen
-                                      "[ ]+([0-9]+)%",]) # Afa
-        self.entry_cmp = re.compile(self.entry_pattern)
+        self.code_match = None
         self.multiplyer = 1
 
     def __str__(self):
-        return '{entry_tuple}'.format(**self.__dict__)
+        return '{0.entry_tuple}'.format(self)
 
     def __repr__(self):
-        return ('{__class__.__name__}(entry_tuple={entry_tuple!r}'
-                ')').format(__class__=self.__class__, **self.__dict__)
+        return ('{0.__class__.__name__}(entry_tuple={0.entry_tuple!r}'
+                ')').format(self)
 
     def _to_money(self, str_money):
         """
@@ -229,10 +830,11 @@ class Entry():
         """
         return int(str_money.replace('.', '')) * self.multiplyer
 
-    def line2entry(self, line):
+    def line2entry(self, line, code_match=None):
         """
-        Extracts entry information from the given line. Tries to search for nine different
-        group in the line. See implementation of entry_pattern. This should match the
+        Extracts entry information from the given line. The line is tokenized from
+        right to left: the fixed format numeric columns are peeled off the end of the
+        line, the rest is the code, the name and the ME. This should match the
         following pattern:
         NNNNNN-NNN STR+WSPACE PREDEFSTR INTEGER INTEGER-. INTEGER% INTEGER-. INTEGER-.
         INTEGER%
@@ -243,24 +845,56 @@ class Entry():
         INTEGER: decimal number, unknown length
         INTEGER-.: a decimal number, grouped with . by thousends e.g 1.589.674
         INTEGER%: an integer with percentage at the end
+        The prices of the credit entries end with a - sign (SIGN). The six numeric
+        tokens are checked by one match of COLUMNS_CMP, every token is scanned at
+        most six times, so the cost is linear in the length of the line.
+        Anything after the VAT% column is ignored: if the last six tokens do not fit,
+        the line is split to every token once, and the window of the columns slides
+        to the left over the tokens.
 
         :param str pdfline: Line to parse, this line should be begin with NNNNNNN-NNN
+        :param code_match: The match of the code (kod group) at the beginning of the
+            line, if it is known already
 
         :return: The actual invoice entry
         :rtype: EntryTuple
         """
-        try:
-            matchgp = self.entry_cmp.match(line).groups()
-            return EntryTuple(matchgp[0], matchgp[1], matchgp[2],
-                              int(matchgp[3]),
-                              self._to_money(matchgp[4]),
-                              int(matchgp[5]),
-                              self._to_money(matchgp[6]),
-                              self._to_money(matchgp[7]),
-                              int(matchgp[8]))
-        except AttributeError as exc:
-            print("Entry pattern regex didn't match for line: {}".format(line))
-            raise exc
+        if code_match is None:
+            code_match = self.CODE_CMP.match(line)
+            if code_match is None:
+                raise ParseError("Entry pattern didn't match", line)
+        me_units = self._me_units
+        if me_units is None:
+            me_units = get_me_units(self.__class__)
+        rest = line[code_match.end('kod'):]
+        tokens = rest.rsplit(None, 6)
+        split = False
+        end = len(tokens)
+        columns_match = self.COLUMNS_CMP.fullmatch
+        while end >= 7:
+            columns = columns_match(' '.join(tokens[end - 6:end]))
+            if columns is not None:
+                #The ME units have no white space, so the unit ends the last token of
+                #the name
+                name_end = tokens[end - 7]
+                for unit in me_units:
+                    if name_end.endswith(unit):
+                        head = rest.rsplit(None, len(tokens) - end + 6)[0] if split else name_end
+                        qty, gross, disc, net, total, vat = columns.groups()
+                        multiplyer = self.multiplyer
+                        return EntryTuple(code_match.group('kod'), head[:len(head) - len(unit)],
+                                          unit, int(qty),
+                                          int(gross.replace('.', '')) * multiplyer,
+                                          int(disc),
+                                          int(net.replace('.', '')) * multiplyer,
+                                          int(total.replace('.', '')) * multiplyer,
+                                          int(vat))
+            if not split:
+                tokens = rest.split()
+                split = True
+                end = len(tokens)
+            end -= 1
+        raise ParseError("Entry pattern didn't match", line)
 
     def parse_line(self, line):
         """
@@ -272,7 +906,8 @@ class Entry():
         ...)
         <disinterested rubish>
         When the Invoice code is found, an additional line is waited, and then it is
-        sent to the line2entry converter.
+        sent to the line2entry converter. The empty lines (e.g. the end of the page,
+        when the entry is split between two pages) are skipped while waiting.
 
         :param str line: The actual line to parse
 
@@ -280,14 +915,37 @@ class Entry():
         :rtype: bool
         """
         if self.entry_found:
-            self.entry_tuple = self.line2entry(" ".join([self.tmp_str, line]))
+            if not line.strip():
+                return False
+            code_match, self.code_match = self.code_match, None
             self.entry_found = False
+            self.entry_tuple = self.line2entry(" ".join([self.tmp_str, line]), code_match)
             return True
-        elif self.CODE_CMP.match(line):
-            self.tmp_str = line
-            self.entry_found = True
+        code_match = self.CODE_CMP.match(line)
+        if code_match:
+            self.begin(code_match)
         return False
 
+    def begin(self, code_match):
+        """
+        Start the entry with its first line, the second line is waited by parse_line
+
+        :param code_match: The match of the code (kod group) at the beginning of the
+            first line
+        """
+        self.tmp_str = code_match.string
+        self.code_match = code_match
+        self.entry_found = True
+
+    def to_list(self):
+        """
+        Collect the entry information which is written to the xlsx file
+
+        :return: the values to write out, starting with the invoice number
+        :rtype: list
+        """
+        return [self.invo.id_no] + list(self.entry_tuple)
+
     def xlsx_write(self, worksheet, row, col):
         """
         Write the entry information to a template xlsx file.
@@ -299,10 +957,142 @@ class Entry():
         :return: the next position of cursor row,col
         :rtype: tuple of (int,int)
         """
-        values = [self.invo.id_no] + list(self.entry_tuple._asdict().values())
-        row, col = list2row(worksheet, row, col, values)
+        row, col = list2row(worksheet, row, col, self.to_list())
         return row, col
 
+    def xlsx_append(self, worksheet):
+        """
+        Append the entry information as a whole row to a (write-only) worksheet.
+
+        :param Worksheet worksheet: Worksheet class to write info
+        """
+        worksheet.append(self.to_list())
+
+
+class EntryColumns():
+    """
+    Compact storage of the entries of an invoice. The fields of the EntryTuple are
+    stored in columns: the fixed width ascii codes packed in a bytearray, the names
+    and units in lists of interned strings (they are repeated a lot), the numbers in
+    arrays. If a code does not fit the width, the codes are stored in a list of
+    interned strings from then on. It can be used as the list of the entries:
+    append() takes a parsed :class:`Entry`, the iteration and the indexing give
+    :class:`EntryRow` views.
+
+    :param Invoice invo: The parent invoice containing the entries
+    :param int code_width: The length of the codes (Entry.CODE_WIDTH), None if it
+        is not fixed
+    """
+    __slots__ = ('invo', 'code_width', 'codes', 'names', 'units', 'quantities',
+                 'gross_prices', 'discounts', 'net_prices', 'totals', 'vats')
+
+    def __init__(self, invo=None, code_width=Entry.CODE_WIDTH):
+        self.invo = invo
+        self.code_width = code_width or None
+        self.codes = [] if self.code_width is None else bytearray()
+        self.names = []
+        self.units = []
+        self.quantities = array('i')
+        self.gross_prices = array('q')
+        self.discounts = array('h')
+        self.net_prices = array('q')
+        self.totals = array('q')
+        self.vats = array('h')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield EntryRow(self, index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError('entry index out of range')
+        return EntryRow(self, index)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}({1!r})'.format(self, list(self))
+
+    def append(self, entry):
+        """
+        Store the entry tuple of the parsed entry
+
+        :param Entry entry: The parsed entry
+        """
+        kod, nev, me, mennyiseg, brutto, kedv, netto, osszesen, afa = entry.entry_tuple
+        if self.code_width is not None and (len(kod) != self.code_width or
+                                            not kod.isascii()):
+            self._unpack_codes()
+        if self.code_width is None:
+            self.codes.append(intern(kod))
+        else:
+            self.codes += kod.encode('ascii')
+        self.names.append(intern(nev))
+        self.units.append(intern(me))
+        self.quantities.append(mennyiseg)
+        self.gross_prices.append(brutto)
+        self.discounts.append(kedv)
+        self.net_prices.append(netto)
+        self.totals.append(osszesen)
+        self.vats.append(afa)
+
+    def entry_tuple(self, index):
+        """
+        :param int index: Index of the entry
+
+        :return: The entry tuple of the entry
+        :rtype: EntryTuple
+        """
+        width = self.code_width
+        if width is None:
+            code = self.codes[index]
+        else:
+            code = self.codes[index * width:(index + 1) * width].decode('ascii')
+        return EntryTuple(code, self.names[index], self.units[index],
+                          self.quantities[index], self.gross_prices[index],
+                          self.discounts[index], self.net_prices[index],
+                          self.totals[index], self.vats[index])
+
+    def _unpack_codes(self):
+        width = self.code_width
+        self.codes = [intern(self.codes[start:start + width].decode('ascii'))
+                      for start in range(0, len(self.codes), width)]
+        self.code_width = None
+
+class EntryRow():
+    """
+    Lightweight view of an entry stored in :class:`EntryColumns`. It has the same
+    interface as a parsed :class:`Entry`: entry_tuple, invo and the writer methods.
+
+    :param EntryColumns columns: The storage of the entries
+    :param int index: Index of the entry
+    """
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    @property
+    def entry_tuple(self):
+        return self.columns.entry_tuple(self.index)
+
+    @property
+    def invo(self):
+        return self.columns.invo
+
+    def __str__(self):
+        return '{0.entry_tuple}'.format(self)
+
+    def __repr__(self):
+        return '{0.__class__.__name__}(entry_tuple={0.entry_tuple!r})'.format(self)
+
+    to_list = Entry.to_list
+    xlsx_write = Entry.xlsx_write
+    xlsx_append = Entry.xlsx_append
 
 class CreditInvoice(Invoice):
     """
@@ -322,6 +1112,17 @@ class CreditInvoice(Invoice):
     AMOUNT_PATTERN = r"[ ]+([0-9]+\.?[0-9]*\.?[0-9]*)-"
     AMOUNT_CMP = re.compile(AMOUNT_PATTERN)
 
+    LINE_RULES = {'id_no': (ID_NO_PATTERN, False),
+                  'orig_date': (ORIG_DATE_PATTERN, False),
+                  'orig_invo_start': (re.escape(ORIG_INVO_START), False),
+                  'orig_invo_no': (Invoice.NO_PATTERN, True),
+                  'amount_start': (re.escape(AMOUNT_START), False),
+                  'amount': ('.*?' + AMOUNT_PATTERN, True)}
+    LINE_CMPS = {state: re.compile(rule[0]) for state, rule in LINE_RULES.items()}
+
+    __slots__ = ('orig_invo_no', 'orig_invo_no_found', 'orig_invo_no_parsed',
+                 'total_sum_found', 'total_sum_parsed')
+
     def __init__(self, no=0, orig_date="", pay_due="", total_sum=0, entries=None,
                  orig_invo_no=0):
         super().__init__(no=no,
@@ -338,72 +1139,71 @@ class CreditInvoice(Invoice):
         self.total_sum_found = False
         self.total_sum_parsed = False
 
-    def parse_line(self, line):
+    def parse_state(self):
         """
+        The current parse state, see Invoice.parse_state(). After the number and the
+        date, the original invoice number and the amount are parsed from the line
+        after their title line.
 
-        :param str line: The actual line to parse
-
-        :return: True when the parsing of the Invoice was started
-        :rtype: bool
+        :return: name of the state, None when everything was parsed
+        :rtype: str
         """
+        if not self.id_no_parsed:
+            return 'id_no'
         if not self.orig_date_parsed:
-            return super().parse_line(line)
+            return 'orig_date'
+        if not self.orig_invo_no_parsed:
+            return 'orig_invo_no' if self.orig_invo_no_found else 'orig_invo_start'
+        if not self.total_sum_parsed:
+            return 'amount' if self.total_sum_found else 'amount_start'
+        return None
+
+    def consume(self, state, groups):
+        """
+        Store the groups matched by the rule of the state, see Invoice.consume()
 
-        elif not self.orig_invo_no_parsed:
-            if not self.orig_invo_no_found:
-                if line.startswith(self.ORIG_INVO_START):
-                    self.orig_invo_no_found = True
-                    return False
-            else:
-                matchob = self.NO_CMP.match(line)
-                self.orig_invo_no = int(matchob.group(1))
-                self.orig_invo_no_parsed = True
-                return False
+        :param str state: The parse state, see parse_state()
+        :param tuple groups: The groups of the matched pattern
 
-        elif not self.total_sum_parsed:
-            if not self.total_sum_found:
-                if line.startswith(self.AMOUNT_START):
-                    self.total_sum_found = True
-                    return False
-            else:
-                matchob = self.AMOUNT_CMP.search(line)
-                self.total_sum = -int(matchob.group(1).replace('.', ''))
-                self.total_sum_parsed = True
-            return False
+        :return: True when the parsing of the Invoice was started
+        :rtype: bool
+        """
+        if state == 'orig_invo_start':
+            self.orig_invo_no_found = True
+        elif state == 'orig_invo_no':
+            self.orig_invo_no = int(groups[0])
+            self.orig_invo_no_parsed = True
+        elif state == 'amount_start':
+            self.total_sum_found = True
+        elif state == 'amount':
+            self.total_sum = -int(groups[0].replace('.', ''))
+            self.total_sum_parsed = True
+        else:
+            return super().consume(state, groups)
         return False
 
-    def xlsx_write(self, worksheet, row, col):
+    def to_list(self):
         """
-        Write the invoice information to a template xlsx file.
+        Collect the credit invoice information which is written to the xlsx file
 
-        :param Worksheet worksheet: Worksheet class to write info
-        :param int row: Row number to start writing
-        :param int col: Column number to start writing
-
-        :return: the next position of cursor row,col
-        :rtype: tuple of (int,int)
+        :return: the values to write out
+        :rtype: list
         """
-        values = [self.id_no,"Credit note",
-                  "EREDETI: " + str(self.orig_invo_no), self.total_sum]
-        positions = config['invo_header_ident']['value']
-        row, col = list2row(worksheet, row, col, values, positions)
-        return row, col
+        return [self.id_no, "Credit note",
+                "EREDETI: " + str(self.orig_invo_no), self.total_sum]
 
 class CreditEntry(Entry):
     """
     These entries contain negative prices as these are creadit invoices Dummy!
     """
+    SIGN = '-'
+    COLUMNS_CMP = columns_cmp(SIGN)
+
+    __slots__ = ()
+
     def __init__(self, entry_tuple=None, invo=None):
         super().__init__(entry_tuple, invo)
-
-        self.entry_pattern = "".join([self.CODE_PATTERN,  #termek kod
-                                      "(.*)", #termek megnevezes
-                                      self.me_pattern, # ME
-                                      "[ ]+([0-9]+)", # mennyiseg
-                                      r"[ ]+([0-9]+\.?[0-9]*)-", # Brutto Egysegar
-                                      "[ ]+([0-9]+)%", # Kedvezmeny
-                                      r"[ ]+([0-9]+\.?[0-9]*)-", # Netto Egysegar
-                                      r"[ ]+([0-9]+\.?[0-9]*\.?[0-9]*)-", # Osszesen
-                                      "[ ]+([0-9]+)%",]) # Afa
-        self.entry_cmp = re.compile(self.entry_pattern)
         self.multiplyer = -1
+
+register_invoice_type(('HELYESB', 'VISSZÁRU'), CreditInvoice, CreditEntry)
+register_invoice_type(('SZÁMLA',), Invoice, Entry)
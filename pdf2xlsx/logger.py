@@ -2,15 +2,53 @@
 """
 Statistics collector helper class for pdf2xlsx
 """
+import time
+from contextlib import contextmanager
+from json import dumps
+
+
+def _new_time():
+    return {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+
+
+def _add_time(times, stage, wall, cpu, calls=1):
+    record = times.setdefault(stage, _new_time())
+    record['wall'] += wall
+    record['cpu'] += cpu
+    record['calls'] += calls
+
+
 class StatLogger():
     """
     Collect statistic about the zip to xlsx process. Assembles a list containin invoice
     number of items. Every item is the number of entries found during the invoice parsing.
     It implements a simple API: new_invo(), new_entr() and __str__()
     A new instance contains an empty list: invo_list
+
+    Besides the invoice list it is the instrumentation of the process:
+
+    - the wall and cpu time of the stages (see stage() and timed_iter())
+    - the counters of pdf files, pages, bytes, invoices, entries, the skipped
+      documents of unknown type and the rejects
+    - the rejected lines and pdf files of the tolerant mode (see reject())
+    - a record of every pdf file with its counters and stage times (see begin_pdf())
+    - the time of the line matching and the entry parsing, if profile_regex is set
+
+    Everything can be exported with report() and to_json()
+
+    :param bool profile_regex: Measure the time of every line match and entry parse call
     """
-    def __init__(self):
+    COUNTERS = ('pdfs', 'pages', 'bytes', 'invoices', 'entries', 'unknown', 'rejects')
+
+    def __init__(self, profile_regex=False):
         self.invo_list = []
+        self.profile_regex = profile_regex
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.stages = {}
+        self.regex = {}
+        self.pdfs = []
+        self.rejects = []
+        self._pdf = None
 
     def __str__(self):
         return '{invo_list}'.format(**self.__dict__)
@@ -21,6 +59,7 @@ class StatLogger():
         The current implementation is a simple list of numbers
         """
         self.invo_list.append(0)
+        self._count('invoices')
 
     def new_entr(self):
         """
@@ -28,3 +67,232 @@ class StatLogger():
         invoice.
         """
         self.invo_list[-1] += 1
+        self._count('entries')
+
+    def drop_invo(self):
+        """
+        The last invoice was dropped (tolerant mode), remove it from the statistics
+        """
+        self._count('invoices', -1)
+        self._count('entries', -self.invo_list.pop())
+
+    def reject(self, reason, line=None, page=None):
+        """
+        Record a line or a whole pdf file which could not be processed in the
+        tolerant mode. The path is the name of the current pdf.
+
+        :param str reason: What went wrong
+        :param str line: The line which could not be parsed, None for the whole file
+        :param int page: Number of the page of the line, starting from 1
+        """
+        path = self._pdf['name'] if self._pdf is not None else None
+        self.rejects.append({'path': path, 'page': page, 'line': line, 'reason': reason})
+        self._count('rejects')
+
+    def new_page(self):
+        """
+        Count a page of the current pdf
+        """
+        self._count('pages')
+
+    def unknown_document(self):
+        """
+        Count a document of unknown invoice type, it was skipped
+        """
+        self._count('unknown')
+
+    def _count(self, counter, value=1):
+        self.counters[counter] += value
+        if self._pdf is not None:
+            self._pdf[counter] += value
+
+    def begin_pdf(self, name, size):
+        """
+        Start the record of a new pdf file, the counters and stage times are
+        collected for it until end_pdf() is called.
+
+        :param str name: Name of the pdf file
+        :param int size: Size of the pdf file in bytes
+        """
+        self._pdf = dict(name=name, source='pdf', stages={},
+                         **dict.fromkeys(self.COUNTERS, 0))
+        self.pdfs.append(self._pdf)
+        self._count('pdfs')
+        self._count('bytes', size)
+
+    def end_pdf(self):
+        """
+        Close the record of the current pdf file
+        """
+        self._pdf = None
+
+    def set_source(self, source):
+        """
+        Note where the invoices of the current pdf came from e.g. 'invoice_cache'
+
+        :param str source: Name of the source
+        """
+        if self._pdf is not None:
+            self._pdf['source'] = source
+
+    def add_time(self, stage, wall, cpu, calls=1, per_pdf=True):
+        """
+        Add the measured time to the stage, and to the current pdf record
+
+        :param str stage: Name of the stage
+        :param float wall: Wall time in seconds
+        :param float cpu: Cpu time in seconds
+        :param int calls: Number of the measured calls
+        :param bool per_pdf: Add the time to the current pdf record too. The stages
+            which are not related to a single pdf should switch it off.
+        """
+        _add_time(self.stages, stage, wall, cpu, calls)
+        if per_pdf and self._pdf is not None:
+            _add_time(self._pdf['stages'], stage, wall, cpu, calls)
+
+    @contextmanager
+    def stage(self, stage, per_pdf=True):
+        """
+        Context manager to measure the wall and cpu time of the with block
+
+        :param str stage: Name of the stage
+        :param bool per_pdf: Add the time to the current pdf record too
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - wall, time.process_time() - cpu,
+                          per_pdf=per_pdf)
+
+    def timed_iter(self, stage, iterable, per_pdf=True):
+        """
+        Measure the time spent in producing the items of the iterable, the time of
+        the consumer is not included.
+
+        :param str stage: Name of the stage
+        :param iterable: The iterable to measure
+        :param bool per_pdf: Add the time to the current pdf record too
+
+        :return: generator of the items of the iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(stage, time.perf_counter() - wall, time.process_time() - cpu,
+                              per_pdf=per_pdf)
+            yield item
+
+    def pages(self, pages):
+        """
+        Measure the text extraction of the pages and count them
+
+        :param pages: iterable of the page texts
+
+        :return: generator of the page texts
+        """
+        for page in self.timed_iter('extract_text', pages):
+            self.new_page()
+            yield page
+
+    def timed_call(self, name, func, *args):
+        """
+        Call the function and measure its time, the line matching and the entry
+        parsing are profiled with it. The call counts as a match if its result is
+        true, e.g. a match object or a parsed entry.
+
+        :param str name: Name of the measured call
+        :param func: The function to call
+        :param args: Arguments of the function
+
+        :return: result of the function
+        """
+        start = time.perf_counter()
+        result = func(*args)
+        record = self.regex.setdefault(name, {'calls': 0, 'matches': 0, 'wall': 0.0})
+        record['wall'] += time.perf_counter() - start
+        record['calls'] += 1
+        record['matches'] += bool(result)
+        return result
+
+    def merge_counts(self, invo_list, pages=0):
+        """
+        Add the invoice list and the page count of an earlier run e.g. from the cache
+
+        :param list invo_list: number of entries of the invoices
+        :param int pages: number of the pages read
+        """
+        self.invo_list.extend(invo_list)
+        self._count('pages', pages)
+        self._count('invoices', len(invo_list))
+        self._count('entries', sum(invo_list))
+        if not invo_list:
+            #Only the documents of unknown type have no invoice
+            self.unknown_document()
+
+    def merge(self, other):
+        """
+        Append the statistics collected by an other logger, e.g. by a worker process
+        during parallel extraction. The order of the invoices is kept.
+
+        :param other: :class:`StatLogger` to merge into this one
+        """
+        self.invo_list.extend(other.invo_list)
+        for counter, value in other.counters.items():
+            self.counters[counter] += value
+        for stage, record in other.stages.items():
+            _add_time(self.stages, stage, record['wall'], record['cpu'], record['calls'])
+        for name, record in other.regex.items():
+            own = self.regex.setdefault(name, {'calls': 0, 'matches': 0, 'wall': 0.0})
+            for key in own:
+                own[key] += record[key]
+        self.pdfs.extend(other.pdfs)
+        self.rejects.extend(other.rejects)
+
+    def report(self):
+        """
+        Collect every statistics to a json serializable dictionary. The throughput
+        is calculated from the 'total' stage, or from the sum of the extraction and
+        parse stages if there is no total.
+
+        :return: the statistics
+        :rtype: dict
+        """
+        if 'total' in self.stages:
+            wall = self.stages['total']['wall']
+        else:
+            wall = sum(self.stages.get(stage, _new_time())['wall']
+                       for stage in ('extract_text', 'parse'))
+        throughput = {}
+        for counter in ('pages', 'bytes', 'invoices', 'entries'):
+            throughput[counter + '_per_s'] = self.counters[counter] / wall if wall else None
+        return {'counters': self.counters,
+                'throughput': throughput,
+                'stages': self.stages,
+                'regex': self.regex,
+                'pdfs': self.pdfs,
+                'rejects': self.rejects,
+                'invo_list': self.invo_list}
+
+    def to_json(self, path=None):
+        """
+        Export the report() as json
+
+        :param str path: Path of the json file, if not given only the json string is
+            returned
+
+        :return: the json report
+        :rtype: str
+        """
+        content = dumps(self.report(), indent=4, ensure_ascii=False)
+        if path is not None:
+            with open(path, 'w', encoding="utf-8") as report_out:
+                report_out.write(content)
+        return content
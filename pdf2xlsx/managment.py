@@ -6,105 +6,442 @@ entries) classes. These are converted to XLSX format.
 """
 
 import os
-import shutil
+import time
 import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from subprocess import run
-from PyPDF2 import PdfFileReader
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
 from .logger import StatLogger
+from .cache import get_invoice_cache, get_text_cache
+from .manifest import Manifest
 from .config import config
-from .invoice import EntryTuple, invo_parser
-from .utility import list2row
+from .backends import open_pdf
+from .invoice import EntryTuple, text_parser
+from .utility import list2row, list2values
 from .order_detail_xlsx_parse import GetOrderDetail, read_xlsx, write_xlsx
 
+#Smaller pdf files are never split to page ranges, see _is_large_pdf
+_MIN_PAGE_BYTES = 512
+
+#Page reader of the page worker processes, see _init_page_worker
+_PAGE_READER = None
+
 #[TODO] Put this to a manager class???
-def pdf2rawtxt(pdfile, logger):
+def pdf2rawtxt(pdfile, logger, name=None, page_workers=1):
     """
     Read out the given pdf file to Invoice and Entry classes to parse it. Utilize
-    PyPFD2 PdfFileReader. Go through every page of the pdf. When a new invoice
-    entry was found by the Entry.parse_line it is appended to the Invoice.entries
+    the configured text extraction backend (PyPDF2 by default). Go through every
+    page of the pdf. When a new invoice entry was found by the Entry.parse_line it is
+    appended to the Invoice.entries
+    The invoices are yielded as soon as they are parsed. If the invoice cache is
+    switched on, the pdf files which were already parsed are not opened again. If
+    only the page text cache has a hit, the cached text is parsed.
+    In tolerant mode (config) a pdf which can not be processed is recorded by
+    logger.reject() instead of raising the error, the invoices yielded before the
+    error are kept.
+
+    :param pdfile: file path of the pdf to process, or the content of the pdf file
+    :type pdfile: str or bytes
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param str name: Name of the pdf file in the statistics, by default the file path
+    :param int page_workers: Number of worker processes to extract the text of the
+        pages of a large pdf, see read_pages
+
+    :return: generator of the invoices filled up with the information from pdf file
+    :rtype: generator of :class:`Invoice`
+    """
+    if not isinstance(pdfile, bytes):
+        name = pdfile if name is None else name
+        with open(pdfile, 'rb') as filedesc:
+            pdfile = filedesc.read()
+
+    logger.begin_pdf(name, len(pdfile))
+    try:
+        yield from _pdf2invoices(pdfile, logger, page_workers)
+    except Exception as exc:
+        if not config['tolerant']['value']:
+            raise
+        logger.reject('{}: {}'.format(type(exc).__name__, exc))
+    finally:
+        logger.end_pdf()
+
+def _pdf2invoices(pdf_data, logger, page_workers=1):
+    """
+    Get the invoices of the pdf, from the invoice cache if possible, see pdf2rawtxt
 
-    :param str pdfile: file path of the pdf to process
+    :param bytes pdf_data: content of the pdf file
     :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param int page_workers: Number of page worker processes, see read_pages
 
-    :return: The invoice entry filled up with the information from pdf file
-    :rtype: :class:`Invoice`
+    :return: generator of the invoices
+    :rtype: generator of :class:`Invoice`
+    """
+    cache = get_invoice_cache()
+    if cache is None:
+        yield from text_parser(_pdf2pages(pdf_data, logger, page_workers), logger)
+        return
+
+    key = cache.key(pdf_data)
+    cached = cache.load(key, logger)
+    if cached is not None:
+        logger.set_source('invoice_cache')
+        yield from cached
+        return
+
+    first_invo = len(logger.invo_list)
+    first_reject = len(logger.rejects)
+    first_page = logger.counters['pages']
+    with cache.store(key) as writer:
+        for invo in text_parser(_pdf2pages(pdf_data, logger, page_workers), logger):
+            writer.add(invo)
+            yield invo
+        #The rejected lines have to be reported again, do not cache the pdf
+        if len(logger.rejects) == first_reject:
+            writer.finish(logger.invo_list[first_invo:], logger.counters['pages'] - first_page)
+
+def _pdf2pages(pdf_data, logger, page_workers=1):
     """
-    with open(pdfile, 'rb') as filedesc:
-        return invo_parser(PdfFileReader(filedesc), logger)
+    Get the text of the pages of the pdf, from the page text cache if possible.
 
-def _init_clean_up(tmp_dir='tmp'):
+    :param bytes pdf_data: content of the pdf file
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param int page_workers: Number of page worker processes, see read_pages
+
+    :return: iterable of the page texts
+    """
+    cache = get_text_cache()
+    if cache is None:
+        return logger.pages(read_pages(pdf_data, page_workers))
+    key = cache.key(pdf_data)
+    pages = cache.load(key)
+    if pages is not None:
+        logger.set_source('text_cache')
+        return logger.pages(pages)
+    return logger.pages(cache.record(key, read_pages(pdf_data, page_workers)))
+
+def read_pages(pdf_data, workers=1):
     """
-    Create tmp directory, delete it first if it already exists, if possible
+    Extract the text of the pages of the pdf with the configured backend (see
+    backends.open_pdf). If more than one worker is given and
+    the pdf has at least split_pages (config) pages, the page range is split into
+    chunks, which are extracted by a process pool. The texts are yielded in the
+    order of the pages in both cases, so an entry split between two pages (or two
+    chunks) is parsed the same way.
 
-    :param str tmp_dir: this is the directory to work during the execution
+    :param bytes pdf_data: content of the pdf file
+    :param int workers: Number of worker processes
+
+    :return: iterable of the page texts
+    """
+    reader = open_pdf(pdf_data)
+    split_pages = config['split_pages']['value']
+    if workers > 1 and split_pages:
+        num_pages = reader.num_pages()
+        if num_pages >= split_pages:
+            return _parallel_pages(pdf_data, num_pages, workers)
+    return reader.pages()
+
+def _init_page_worker(pdf_data, backend):
+    """
+    Initializer of the page worker processes, the pdf is opened only once in every
+    worker.
+
+    :param bytes pdf_data: content of the pdf file
+    :param str backend: name of the text extraction backend
     """
+    global _PAGE_READER
+    _PAGE_READER = open_pdf(pdf_data, backend)
+
+def _extract_page_range(page_range):
+    """
+    Extract the text of the pages in a page worker process
+
+    :param tuple page_range: first and last+1 page number
+
+    :return: the texts of the pages
+    :rtype: list of str
+    """
+    start, stop = page_range
+    return _PAGE_READER.page_range(start, stop)
+
+def _parallel_pages(pdf_data, num_pages, workers):
+    """
+    Extract the text of the pages with a process pool, see read_pages. Every worker
+    gets about four chunks, so the load is balanced. The not yet started chunks are
+    cancelled if the generator is closed early (e.g. unknown document).
+
+    :return: generator of the page texts in the order of the pages
+    :rtype: generator of str
+    """
+    chunk = max(1, -(-num_pages // (4 * workers)))
+    page_ranges = [(start, min(start + chunk, num_pages))
+                   for start in range(0, num_pages, chunk)]
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(page_ranges)),
+                                   initializer=_init_page_worker,
+                                   initargs=(pdf_data, config['backend']['value']))
+    futures = [executor.submit(_extract_page_range, page_range)
+               for page_range in page_ranges]
     try:
-        shutil.rmtree(tmp_dir)
-    except FileNotFoundError:
-        #Do not print any silly message as this is the expected behaviour
-        pass
+        for future in futures:
+            yield from future.result()
     finally:
-        os.mkdir(tmp_dir)
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+def _is_large_pdf(pdfile):
+    """
+    Check whether the pdf is split to page ranges (see read_pages), i.e. it has at
+    least split_pages pages. The page count is read only if the file is big enough
+    to have that many pages, the smaller files are not opened.
+
+    :param pdfile: file path or content of the pdf
+    :type pdfile: str or bytes
+
+    :return: True if the pdf has at least split_pages pages
+    :rtype: bool
+    """
+    split_pages = config['split_pages']['value']
+    if not split_pages:
+        return False
+    size = len(pdfile) if isinstance(pdfile, bytes) else os.path.getsize(pdfile)
+    if size < split_pages * _MIN_PAGE_BYTES:
+        return False
+    if not isinstance(pdfile, bytes):
+        with open(pdfile, 'rb') as filedesc:
+            pdfile = filedesc.read()
+    try:
+        return open_pdf(pdfile).num_pages() >= split_pages
+    except Exception:
+        #A broken pdf is sent to the pool, it is rejected there like the small ones
+        return False
 
-def extract_zip(src_name, directory):
+def iter_zip_pdfs(src_name, extension='.pdf'):
     """
-    Extract the pdf files from the zip, there is no sanity check for the arguments
-    :param str src_name: Path to a zip file to extract
-    :param str dir: Path to the target directory to extract the zip file
+    Go through the members of the zip file and read out every file with
+    **extension** directly from the archive, nothing is extracted to the disk.
+    The files are yielded in the order they are stored in the zip. The name of a
+    file is the path of the zip and the member name, so the members of different
+    zip files with the same name are told apart (e.g. in the rejects and the
+    manifest).
+
+    :param str src_name: Path to the zip file
+    :param str extension: '.pdf' by default, if the member has this extension it is selected
+
+    :return: generator of the name and the content of the pdf file
+    :rtype: generator of tuple (str, bytes)
     """
     with zipfile.ZipFile(src_name) as myzip:
-        myzip.extractall(directory)
+        for info in myzip.infolist():
+            if not info.is_dir() and info.filename.endswith(extension):
+                yield '{}/{}'.format(src_name, info.filename), myzip.read(info)
 
-def get_pdf_files(directory, extension='.pdf'):
+def iter_dir_pdfs(directory, extension='.pdf'):
     """
-    Walks through the given **dir** and collects every files with **extension**
+    Walks through the given **directory** and reads every file with **extension**.
+    The files are yielded in sorted order of their path.
 
-    :param str dir: the root directory to start the walk
+    :param str directory: the root directory to start the walk
     :param str extension: '.pdf' by default, if the file has this extension it is selected
 
-    :return: list of pdf file path
-    :rtype: list of str
+    :return: generator of the file path and the content of the pdf file
+    :rtype: generator of tuple (str, bytes)
     """
-    pdf_list = []
-    for dir_path, _dummy, file_list in os.walk(directory):
-        for filename in file_list:
+    for dir_path, dir_list, file_list in os.walk(directory):
+        dir_list.sort()
+        for filename in sorted(file_list):
             if filename.endswith(extension):
-                pdf_list.append(os.path.join(dir_path, filename))
-    return pdf_list
+                path = os.path.join(dir_path, filename)
+                with open(path, 'rb') as filedesc:
+                    yield path, filedesc.read()
 
-def extract_invoces(pdf_list, logger):
+def iter_pdf_sources(paths, extension='.pdf'):
     """
-    Get the invoices from the pdf files in th pdf_list
-    Wrapper around the pdf2rawtxt call
+    Read the pdf files from several sources one after the other. A source can be
+    a zip file, a directory or a single pdf file.
+
+    :param list paths: list of zip files, directories or pdf files
+    :param str extension: '.pdf' by default, the extension of the pdf files
+
+    :return: generator of the name and the content of the pdf files
+    :rtype: generator of tuple (str, bytes)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_dir_pdfs(path, extension)
+        elif zipfile.is_zipfile(path):
+            yield from iter_zip_pdfs(path, extension)
+        else:
+            with open(path, 'rb') as filedesc:
+                yield path, filedesc.read()
+
+def _make_dst_dir(dst_dir):
+    """
+    Create the destination directory of the generated files if it does not exist
+
+    :param str dst_dir: Path to the destination directory, '' for the cwd
+    """
+    if dst_dir:
+        os.makedirs(dst_dir, exist_ok=True)
+
+def get_worker_count(workers=None):
+    """
+    Resolve the number of worker processes to use. If it is not given, the value
+    is taken from the configuration, 0 means one worker per cpu core.
+
+    :param int workers: Requested number of workers, None to use the config
+
+    :return: Number of worker processes, at least 1
+    :rtype: int
+    """
+    if workers is None:
+        workers = config['workers']['value']
+    if not workers:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+def _init_worker(conf_values):
+    """
+    Initializer of the worker processes. The worker may be spawned with a fresh
+    interpreter (e.g. on Windows), so the configuration values of the parent
+    process are copied over.
+
+    :param dict conf_values: config key -> value pairs of the parent process
+    """
+    for key, value in conf_values.items():
+        config[key]['value'] = value
+
+def _split_source(source):
+    """
+    The pdf sources are either file paths, contents or (name, content) pairs
 
-    :param list pdf_list: List of pdf files path to process.
+    :return: name (None if not known) and the pdf file
+    :rtype: tuple of (str, str or bytes)
+    """
+    if isinstance(source, tuple):
+        return source
+    return None, source
+
+def _pdf2rawtxt_worker(source, profile_regex=False):
+    """
+    Process a single pdf file in a worker process. Every worker collects the
+    statistics into its own logger, which is sent back with the invoices.
+
+    :param source: file path, content or (name, content) of the pdf to process
+    :param bool profile_regex: Measure the time of the line parsing
+
+    :return: The parsed invoices and the statistics about them
+    :rtype: tuple of (list of :class:`Invoice`, :class:`StatLogger`)
+    """
+    logger = StatLogger(profile_regex=profile_regex)
+    name, pdfile = _split_source(source)
+    invoices = list(pdf2rawtxt(pdfile, logger, name))
+    return invoices, logger
+
+def iter_invoices(pdf_iter, logger, workers=1):
+    """
+    Generator version of extract_invoces. The invoices are yielded one by one
+    in the order of the pdf files, as soon as they are available. When more than
+    one worker is requested, the pdf files are distributed over a process pool,
+    but only a limited number of them is sent out in advance, so the number of
+    invoices held in memory is bounded. The statistics of the workers are merged
+    to the logger in the order of the pdf files. The pdf files with at least
+    split_pages pages are processed in this process, and their pages are
+    distributed over the workers instead (see read_pages). The pool of the pdf files
+    is shut down meanwhile and started again for the next small pdf, so there are
+    never more worker processes than workers.
+
+    :param pdf_iter: Iterable of pdf files (path, content or (name, content) pair)
     :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param int workers: Number of worker processes, None to use the config
 
-    :return: list of invoices
-    :rtype: list of :class:`Invoice`
+    :return: generator of invoices
+    :rtype: generator of :class:`Invoice`
     """
-    invoice_list = []
-    for pdfile in pdf_list:
-        invoice_list.append(pdf2rawtxt(pdfile, logger))
-    return invoice_list
+    workers = get_worker_count(workers)
+    if workers == 1:
+        for source in pdf_iter:
+            name, pdfile = _split_source(source)
+            yield from pdf2rawtxt(pdfile, logger, name)
+        return
+
+    conf_values = {key: value['value'] for key, value in config.items()}
+    pending = deque()
+    executor = None
+    try:
+        for source in pdf_iter:
+            name, pdfile = _split_source(source)
+            if _is_large_pdf(pdfile):
+                while pending:
+                    invoices, worker_logger = pending.popleft().result()
+                    logger.merge(worker_logger)
+                    yield from invoices
+                if executor is not None:
+                    executor.shutdown()
+                    executor = None
+                yield from pdf2rawtxt(pdfile, logger, name, page_workers=workers)
+                continue
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                               initargs=(conf_values,))
+            pending.append(executor.submit(_pdf2rawtxt_worker, source,
+                                           logger.profile_regex))
+            if len(pending) >= 2 * workers:
+                invoices, worker_logger = pending.popleft().result()
+                logger.merge(worker_logger)
+                yield from invoices
+        while pending:
+            invoices, worker_logger = pending.popleft().result()
+            logger.merge(worker_logger)
+            yield from invoices
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
-def _post_clean_up(tmp_dir='tmp'):
+def extract_invoces(pdf_list, logger, workers=1):
     """
-    Cleanup after execution, remove the extracted zip file and tmp directory
+    Get the invoices from the pdf files in th pdf_list
+    Wrapper around the iter_invoices call. When more than one worker is requested
+    the pdf files are distributed over a process pool. The invoices are returned
+    in the order of the pdf_list, and the statistics of the workers are merged
+    to the logger in the same order, so the result is the same as a serial run.
 
-    :param str tmp_dir: Temporary directory to clean_up
+    :param list pdf_list: List of pdf files (path or content) to process.
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param int workers: Number of worker processes, None to use the config
+
+    :return: list of invoices
+    :rtype: list of :class:`Invoice`
     """
-    shutil.rmtree(tmp_dir)
+    return list(iter_invoices(pdf_list, logger, workers))
+
+REJECT_LABELS = ["Path", "Page", "Line", "Reason"]
 
+def _reject_rows(rejects):
+    for reject in rejects:
+        yield [reject['path'], reject['page'], reject['line'], reject['reason']]
 
-def invoices2xlsx(invoices, directory='', name='Invoices01.xlsx'):
+def invoices2xlsx(invoices, directory='', name='Invoices01.xlsx', write_only=False,
+                  rejects=None):
     """
     Write invoice information to xlsx template file. Go through every invoce and
-    write them out. Simple. Utilizes the openpyxl module
+    write them out. Simple. Utilizes the openpyxl module. In write-only mode the
+    rows are streamed to the file, so the memory usage does not depend on the
+    number of the rows.
 
     :param invoices list of Invocie: Representation of invoices from the pdf files
+    :param str directory: Directory to save the xlsx file to
+    :param str name: Name of the xlsx file
+    :param bool write_only: Use openpyxl write-only worksheets, and append whole rows
+    :param list rejects: The rejects of the tolerant mode (see StatLogger.reject), if
+        there is any, they are written to the "rejects" sheet. The list is read after
+        the invoices, so it may be filled up during the iteration of the invoices.
     """
+    if write_only:
+        _invoices2xlsx_write_only(invoices, os.path.join(directory, name), rejects)
+        return
+
     workbook = Workbook()
     worksheet_invo = workbook.active
     worksheet_entr = workbook.create_sheet()
@@ -125,8 +462,66 @@ def invoices2xlsx(invoices, directory='', name='Invoices01.xlsx'):
             row_entr, col_entr = entr.xlsx_write(worksheet_entr, row_entr, col_entr)
     #increase the invoice tab B column width to show the whole id
     worksheet_invo.column_dimensions['B'].width = 15
+    if rejects:
+        worksheet_rej = workbook.create_sheet('rejects')
+        for row in [REJECT_LABELS] + list(_reject_rows(rejects)):
+            worksheet_rej.append(row)
+
+    workbook.save(os.path.join(directory, name))
 
-    workbook.save(os.path.join(directory, name))  
+def _invoices2xlsx_write_only(invoices, path, rejects=None):
+    """
+    Write-only version of invoices2xlsx, see there.
+
+    :param invoices list of Invocie: Representation of invoices from the pdf files
+    :param str path: Path of the xlsx file
+    :param list rejects: The rejects of the tolerant mode
+    """
+    workbook = Workbook(write_only=True)
+    worksheet_invo = workbook.create_sheet()
+    worksheet_entr = workbook.create_sheet()
+    #the column width has to be set before the first row is written
+    worksheet_invo.column_dimensions['B'].width = 15
+
+    labels = ["Invoice Number", "Date of Invoice", "Payment Date", "Amount"]
+    positions = config['invo_header_ident']['value']
+    worksheet_invo.append(list2values(labels, positions))
+    worksheet_entr.append(["Invoice Number"] + list(EntryTuple._fields))
+    for invo in invoices:
+        invo.xlsx_append(worksheet_invo)
+        for entr in invo.entries:
+            entr.xlsx_append(worksheet_entr)
+    if rejects:
+        worksheet_rej = workbook.create_sheet('rejects')
+        worksheet_rej.append(REJECT_LABELS)
+        for row in _reject_rows(rejects):
+            worksheet_rej.append(row)
+
+    workbook.save(path)
+
+def append_invoices2xlsx(invoices, path, rejects=None):
+    """
+    Append the invoices to an existing xlsx file written by invoices2xlsx. The rows
+    are added after the last rows of the invoice and the entry sheets. The
+    "rejects" sheet is replaced with the rejects of this run.
+
+    :param invoices list of Invocie: Representation of invoices from the pdf files
+    :param str path: Path of the existing xlsx file
+    :param list rejects: The rejects of the tolerant mode
+    """
+    workbook = load_workbook(path)
+    worksheet_invo, worksheet_entr = workbook.worksheets[:2]
+    for invo in invoices:
+        invo.xlsx_append(worksheet_invo)
+        for entr in invo.entries:
+            entr.xlsx_append(worksheet_entr)
+    if 'rejects' in workbook.sheetnames:
+        workbook.remove(workbook['rejects'])
+    if rejects:
+        worksheet_rej = workbook.create_sheet('rejects')
+        for row in [REJECT_LABELS] + list(_reject_rows(rejects)):
+            worksheet_rej.append(row)
+    workbook.save(path)
 
 def run_excel(xlsx_path):
     """
@@ -138,37 +533,105 @@ def run_excel(xlsx_path):
     run([config['excel_path']['value'], xlsx_path])
 
 
+def pdfs2xlsx(pdf_iter, xlsx_path, logger, workers=None, write_only=False,
+              incremental=False):
+    """
+    Streaming pipeline from the pdf files to the xlsx rows. The pdf files are
+    read one by one, every parsed invoice is passed to the xlsx writer
+    immediately, so only a bounded number of invoices is held in memory.
+    In incremental mode only the pdf files and invoices which are not in the
+    manifest of the xlsx file are processed, and they are appended to it.
+    The rejects of the tolerant mode are written to the "rejects" sheet. In
+    incremental mode none of the invoices of a rejected pdf file is written, and the
+    pdf is left out from the manifest, so it is processed again in the next run.
+
+    :param pdf_iter: Iterable of the name and the content of the pdf files, see
+        iter_pdf_sources
+    :param str xlsx_path: path of the generated xlsx file
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param int workers: Number of worker processes, None to use the config
+    :param bool write_only: Stream the rows to the xlsx file with a write-only workbook
+    :param bool incremental: Append the new invoices to the existing xlsx file
+
+    The logger measures the 'read', 'total' and 'write' stages, the last is the
+    time spent in the xlsx writer itself.
+    """
+    with logger.stage('total', per_pdf=False):
+        pdf_iter = logger.timed_iter('read', pdf_iter, per_pdf=False)
+        manifest = None
+        if incremental:
+            manifest = Manifest(xlsx_path)
+            pdf_iter = manifest.new_pdfs(pdf_iter)
+        invoices = iter_invoices(pdf_iter, logger, workers)
+        if manifest is not None:
+            invoices = manifest.new_invoices(invoices, logger)
+
+        producer = StatLogger()
+        wall, cpu = time.perf_counter(), time.process_time()
+        invoices = producer.timed_iter('produce', invoices)
+        if manifest is not None and os.path.exists(xlsx_path):
+            append_invoices2xlsx(invoices, xlsx_path, rejects=logger.rejects)
+        else:
+            directory, name = os.path.split(xlsx_path)
+            invoices2xlsx(invoices, directory, name=name, write_only=write_only,
+                          rejects=logger.rejects)
+        produce = producer.stages['produce']
+        logger.add_time('write', time.perf_counter() - wall - produce['wall'],
+                        time.process_time() - cpu - produce['cpu'], per_pdf=False)
+        if manifest is not None:
+            manifest.forget_pdfs(reject['path'] for reject in logger.rejects)
+            manifest.store()
+
+
+def zip2xlsx(src_name, xlsx_path, logger, file_extension='.pdf', workers=None,
+             write_only=False, incremental=False):
+    """
+    Streaming pipeline from the zip members to the xlsx rows, see pdfs2xlsx
+
+    :param str src_name: path to the zip file to process
+    :param str xlsx_path: path of the generated xlsx file
+    :param logger: :class:`StatLogger`, collect statistical data about parsing
+    :param str file_extension: the file extension to use during file selection
+    :param int workers: Number of worker processes, None to use the config
+    :param bool write_only: Stream the rows to the xlsx file with a write-only workbook
+    :param bool incremental: Append the new invoices to the existing xlsx file
+    """
+    pdfs2xlsx(iter_zip_pdfs(src_name, file_extension), xlsx_path, logger,
+              workers=workers, write_only=write_only, incremental=incremental)
+
+
 def do_it(src_name, dst_dir='', xlsx_name='Invoices01.xlsx',
-          tmp_dir='tmp', file_extension='.pdf'):
+          tmp_dir='tmp', file_extension='.pdf', workers=1, write_only=False,
+          incremental=False):
     """
-    Main script to manage the zip to xls process. It is responsible to create/cleanup
-    temporary directories and files. After zip extraction, seraches every file which
-    ends with `file_extension` Then it builds up a list of invoices and writes them
-    to xlsx format and opens it up in the predefined xlsx_viewer. If the dst_dir happens
-    to be the same as the tmp_dir, the generated xlsx file is removed after the run.
+    Main script to manage the zip to xls process. The files which end with
+    `file_extension` are read directly from the zip, nothing is extracted to the disk.
+    The invoices are streamed to xlsx format (see zip2xlsx), which is opened up in
+    the predefined xlsx_viewer.
 
-    :param str src_name: path to the zip file to extract
+    :param str src_name: path to the zip file to process
     :param str dst_dir: path to the directory to put the generated xlsx file by default
         the cwd
-    :param str tmp_dir: temporary directory to work in. **This directory is erased
-        at the beginning of the script** By default it is `tmp`
+    :param str tmp_dir: not used anymore, kept for backward compatibility
     :param str file_extension: the file extension to use during file selection. By
         default it is `.pdf`
     :param str xlsx_name: Name of the oputput file
+    :param int workers: Number of worker processes to parse the pdf files. It is
+        serial by default, as the gui and the frozen executable may not be able to
+        start worker processes. None takes the number from the configuration.
+    :param bool write_only: Stream the rows to the xlsx file with a write-only workbook
+    :param bool incremental: Only process the new pdf files and append their invoices
+        to the existing xlsx file
     """
-    _init_clean_up(tmp_dir)
-
-    extract_zip(src_name, tmp_dir)
-
-    pdf_list = get_pdf_files(os.path.join(os.getcwd(), tmp_dir), file_extension)
+    _make_dst_dir(dst_dir)
 
     logger = StatLogger()
 
-    invoice_list = extract_invoces(pdf_list, logger)
-
-    invoices2xlsx(invoice_list, dst_dir, name=xlsx_name)
+    zip2xlsx(src_name, os.path.join(dst_dir, xlsx_name), logger,
+             file_extension=file_extension, workers=workers, write_only=write_only,
+             incremental=incremental)
 
-    run_excel(os.path.join(dst_dir, config['xlsx_name']['value']))
+    run_excel(os.path.join(dst_dir, xlsx_name))
 
     print(logger)
 
@@ -177,24 +640,23 @@ def do_it(src_name, dst_dir='', xlsx_name='Invoices01.xlsx',
 
 
 def do_it2(src_name, dst_dir='', xlsx_name='Invoices01.xlsx',
-           tmp_dir='tmp'):
+           tmp_dir='tmp', workers=1):
     """
-    Main script to manage the zip to xls process. It is responsible to create/cleanup
-    temporary directories and files. After zip extraction, seraches every file which
-    ends with `file_extension` Then it builds up a list of invoices and writes them
-    to xlsx format and opens it up in the predefined xlsx_viewer. If the dst_dir happens
-    to be the same as the tmp_dir, the generated xlsx file is removed after the run.
+    Main script to manage the order detail xlsx conversion. It reads the orders from
+    the source xlsx, writes them to a new xlsx file and opens it up in the predefined
+    xlsx_viewer.
 
-    :param str src_name: path to the zip file to extract
+    :param str src_name: path to the order detail xlsx file
     :param str dst_dir: path to the directory to put the generated xlsx file by default
         the cwd
-    :param str tmp_dir: temporary directory to work in. **This directory is erased
-        at the beginning of the script** By default it is `tmp`
+    :param str tmp_dir: not used anymore, kept for backward compatibility
     :param str xlsx_name: Name of the oputput file
+    :param int workers: Number of worker processes to parse the worksheets, serial by
+        default (see do_it). None takes the number from the configuration.
     """
-    _init_clean_up(tmp_dir)
+    _make_dst_dir(dst_dir)
 
-    order_list = read_xlsx(GetOrderDetail, src_name)
+    order_list = read_xlsx(GetOrderDetail, src_name, get_worker_count(workers))
 
     write_xlsx(order_list, filename=os.path.join(dst_dir, config['xlsx_name']['value']))
 
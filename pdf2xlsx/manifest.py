@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest of the pdf files and invoices already written to an invoice workbook,
+it is used by the incremental (append) mode.
+"""
+import hashlib
+import os
+from json import dumps, loads
+from openpyxl import load_workbook
+from .config import config
+
+
+class Manifest():
+    """
+    Collect the hash of the processed pdf files and the number of the written
+    invoices (Invoice.id_no). The manifest is stored next to the xlsx file as a json
+    file. If there is no manifest yet, but the xlsx file exists, the invoice numbers
+    are read from its invoice sheet, so the already written invoices are not duplicated.
+
+    :param str xlsx_path: Path of the invoice workbook
+    """
+    def __init__(self, xlsx_path):
+        self.xlsx_path = xlsx_path
+        self.path = xlsx_path + '.manifest.json'
+        self.pdfs = set()
+        self.invoices = set()
+        #name -> hash of the pdf files registered in this run
+        self._names = {}
+        if os.path.exists(self.xlsx_path):
+            try:
+                self.load()
+            except FileNotFoundError:
+                self._load_xlsx()
+
+    def load(self):
+        """
+        Load the manifest from the json file
+        """
+        with open(self.path, 'r', encoding="utf-8") as manifest_in:
+            content = loads(manifest_in.read())
+        self.pdfs = set(content['pdfs'])
+        self.invoices = set(content['invoices'])
+
+    def _load_xlsx(self):
+        position = config['invo_header_ident']['value'][0]
+        workbook = load_workbook(self.xlsx_path, read_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(min_row=2, values_only=True):
+                if len(row) > position and row[position] is not None:
+                    self.invoices.add(row[position])
+        finally:
+            workbook.close()
+
+    def store(self):
+        """
+        Store the manifest to the json file
+        """
+        content = {'pdfs': sorted(self.pdfs), 'invoices': sorted(self.invoices)}
+        with open(self.path, 'w', encoding="utf-8") as manifest_out:
+            manifest_out.write(dumps(content, indent=1))
+
+    def new_pdfs(self, pdf_iter):
+        """
+        Filter out the pdf files which were processed already, the new ones are
+        registered.
+
+        :param pdf_iter: Iterable of the name and the content of the pdf files
+
+        :return: generator of the name and the content of the new pdf files
+        :rtype: generator of tuple (str, bytes)
+        """
+        for name, pdf_data in pdf_iter:
+            pdf_hash = hashlib.sha256(pdf_data).hexdigest()
+            if pdf_hash not in self.pdfs:
+                self.pdfs.add(pdf_hash)
+                self._names[name] = pdf_hash
+                yield name, pdf_data
+
+    def forget_pdfs(self, names):
+        """
+        Unregister the pdf files of this run e.g. the rejected ones, so they are
+        processed again in the next run.
+
+        :param names: Iterable of the names of the pdf files
+        """
+        for name in names:
+            pdf_hash = self._names.pop(name, None)
+            if pdf_hash is not None:
+                self.pdfs.discard(pdf_hash)
+
+    def new_invoices(self, invoices, logger=None):
+        """
+        Filter out the invoices which were written already, the new ones are
+        registered. If the logger is given, the invoices of a pdf file are held back
+        until the pdf is finished, and the invoices of a rejected pdf are neither
+        passed on nor registered. So the pdf is processed again as a whole in the next
+        run (see forget_pdfs), even if some of its invoices could be parsed.
+
+        :param invoices: Iterable of :class:`Invoice`
+        :param logger: :class:`StatLogger` which collects the records of the pdf files
+
+        :return: generator of the new invoices
+        :rtype: generator of :class:`Invoice`
+        """
+        if logger is None:
+            yield from self._register(invoices)
+            return
+        #The record of the pdf of the invoice is the last one when it is yielded
+        pdf, held = None, []
+        for invo in invoices:
+            current = logger.pdfs[-1] if logger.pdfs else None
+            if current is not pdf:
+                yield from self._register(held, pdf)
+                pdf, held = current, []
+            held.append(invo)
+        yield from self._register(held, pdf)
+
+    def _register(self, invoices, pdf=None):
+        if pdf is not None and pdf['rejects']:
+            return
+        for invo in invoices:
+            if invo.id_no not in self.invoices:
+                self.invoices.add(invo.id_no)
+                yield invo
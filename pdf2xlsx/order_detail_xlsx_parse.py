@@ -2,13 +2,27 @@
 """
 Read the Order details xlsx and extract data from it to the  Order classes
 """
+import csv
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from json import dumps
 from openpyxl import load_workbook, Workbook
 from collections import OrderedDict
+from functools import partial
 from itertools import repeat
+from .config import config
 
 ORDER_START_TOKEN = 'Line Item:'
 SIZE_BEGIN_TOKEN = 'Size'
 SIZE_END_TOKEN = 'Total Qty:'
+#The state machine reads only the first columns of the rows (wholesale price: H)
+ORDER_COLUMNS = 8
+CSV_HEADER = ['CRD', 'Style/Color', 'Wholesale', 'Style Name', 'Gender', 'Size', 'Qty']
+
+#Characters which are not allowed in the worksheet names, and their maximal length
+SHEET_NAME_INVALID_CMP = re.compile(r'[\\/?*\[\]:]')
+SHEET_NAME_LENGTH = 31
 
 
 class StateError(Exception):
@@ -16,9 +30,55 @@ class StateError(Exception):
         self.message = message
 
 
+_SCALE_INDEXES = {}
+
+def get_scale_index(scales):
+    """
+    Get the shared size index of the size scales. The index is built once for
+    every scale list, so an order only copies the template of its scale, see also
+    clear_scale_indexes(). The index is looked up by the content of the list, so
+    a list which was changed in place gets its own index.
+
+    :param list scales: list of size scales, every scale is a list of size labels
+
+    :return: size label -> (number of the scale, template OrderedDict of the scale
+        with empty quantities)
+    :rtype: dict
+    """
+    key = tuple(map(tuple, scales))
+    index = _SCALE_INDEXES.get(key)
+    if index is None:
+        index = {}
+        for scale_no, scale in enumerate(key):
+            template = OrderedDict(zip(scale, repeat('')))
+            for size in scale:
+                #A size label belongs to the first scale which contains it
+                index.setdefault(size, (scale_no, template))
+        _SCALE_INDEXES[key] = index
+    return index
+
+def clear_scale_indexes():
+    """
+    Drop the shared size indexes, they are rebuilt on demand. It should be called
+    when the order_scales config is updated, so the indexes of the old scales are
+    freed.
+    """
+    _SCALE_INDEXES.clear()
+
+
 class GetOrderDetail:
+    """
+    Parse an order from the rows of an order detail sheet. The rows are fed one by
+    one to the instance, it returns itself when the order is finished. The states
+    are integers, every state has a handler in HANDLERS, which is selected by the
+    state without any comparison.
 
+    The size scales are taken from the order_scales config, if it is empty the
+    built-in SCALES are used. The first scale is the adult scale, the gender of
+    those orders is set from the name.
+    """
     STATES = ["NO_ORDER", "STYLE_COLOR", "STYLE_NAME", "WAIT_SIZE", "SIZE", "FINISHED"]
+    NO_ORDER, STYLE_COLOR, STYLE_NAME, WAIT_SIZE, SIZE, FINISHED = range(len(STATES))
     SCALE0 = ['5','5.5','6','6.5','7','7.5','8','8.5','9','9.5','10','10.5','11','11.5','12','12.5','13','13.5','14','14.5',]
     # SCALE0 = [str(int(k)) if k.is_integer() else str(k) for k in [x/10 for x in list(range(50, 150, 5))]]
     SCALE1 = ['10.5C','11C','11.5C','12C','12.5C','13C','13.5C','1Y','1.5Y','2Y', '2.5Y','3Y',]
@@ -29,7 +89,7 @@ class GetOrderDetail:
     SCALES = [SCALE0, SCALE1, SCALE2, SCALE3]
 
     def __init__(self, CRDate=None, ord_id=None, wholesale=None, ord_name=None, sizes=None, scale=None, gender=None):
-        self.state = "NO_ORDER"
+        self.state = self.NO_ORDER
         self.CRDate = CRDate
         self.ord_id = ord_id
         self.wholesale = wholesale
@@ -39,58 +99,86 @@ class GetOrderDetail:
         self.gender = gender
         self.generated_scale = False
 
+    @classmethod
+    def scales(cls):
+        """
+        :return: the size scales of the config, or the built-in SCALES
+        :rtype: list of list
+        """
+        return config['order_scales']['value'] or cls.SCALES
+
     def gen_scale(self, current_size):
-        for s in self.SCALES:
-            if current_size in s:
-                if s is self.SCALE0:
-                    if "women" in self.ord_name.lower():
-                        self.gender = 'w'
-                    else:
-                        self.gender = 'm'
-                self.sizes = OrderedDict(zip(s, repeat('')))
-                return self.sizes
+        """
+        Set up the sizes of the order from the template of the scale of the first
+        size. A size which is not in any scale gets an empty layout, the sizes are
+        added in the order of the rows.
+
+        :param str current_size: The first size label of the order
+
+        :return: the sizes of the order
+        :rtype: OrderedDict
+        """
+        scale_no, template = get_scale_index(self.scales()).get(current_size,
+                                                                 (None, OrderedDict()))
+        if scale_no == 0:
+            if "women" in self.ord_name.lower():
+                self.gender = 'w'
+            else:
+                self.gender = 'm'
+        self.scale = scale_no
+        self.sizes = template.copy()
+        return self.sizes
+
+    def _no_order(self, row):
+        if row[0] == ORDER_START_TOKEN:
+            self.CRDate = row[4]
+            self.state = self.STYLE_COLOR
+
+    def _style_color(self, row):
+        self.ord_id = row[1]
+        self.wholesale = row[7]
+        self.state = self.STYLE_NAME
+
+    def _style_name(self, row):
+        self.ord_name = row[1]
+        self.state = self.WAIT_SIZE
+
+    def _wait_size(self, row):
+        if row[0] == SIZE_BEGIN_TOKEN:
+            self.state = self.SIZE
+
+    def _size(self, row):
+        if row[0] == SIZE_END_TOKEN:
+            self.state = self.FINISHED
+            return self
+        if self.generated_scale is False:
+            self.generated_scale = True
+            self.gen_scale(row[0])
+        self.sizes[row[0]] = int(row[2])
+        return None
+
+    def _finished(self, row):
+        return None
+
+    HANDLERS = (_no_order, _style_color, _style_name, _wait_size, _size, _finished)
 
     def __call__(self, row):
         """
         gets a new row to parse
+
+        :param tuple row: values of the first ORDER_COLUMNS cells of the row
+
+        :return: the instance itself when the order is finished, otherwise None
         """
-        if self.state == "NO_ORDER":
-            if row[0].value == ORDER_START_TOKEN:
-                self.CRDate = row[4].value
-                self.state = "STYLE_COLOR"
-            return None
-
-        if self.state == "STYLE_COLOR":
-            self.ord_id = row[1].value
-            self.wholesale = row[7].value
-            self.state = "STYLE_NAME"
-            return None
-
-        if self.state == "STYLE_NAME":
-            self.ord_name = row[1].value
-            self.state = "WAIT_SIZE"
-            return None
-
-        if self.state == "WAIT_SIZE":
-            if row[0].value == SIZE_BEGIN_TOKEN:
-                self.state = "SIZE"
-            return None
-
-        if self.state == "SIZE":
-            if row[0].value == SIZE_END_TOKEN:
-                self.state = "FINISHED"
-                return self
-            if self.generated_scale is False:
-                self.generated_scale = True
-                self.gen_scale(row[0].value)
-            self.sizes[row[0].value] = int(row[2].value)
-            return None
-
-        if self.state != "FINISHED":
+        try:
+            handler = self.HANDLERS[self.state]
+        except (IndexError, TypeError):
             raise StateError("Undefined state found!: {state}".format(**self.__dict__))
+        return handler(self, row)
 
     def __str__(self):
-        return "{CRDate}, {ord_id}, {wholesale}, {ord_name}, {sizes}, {state}".format(**self.__dict__)
+        return "{CRDate}, {ord_id}, {wholesale}, {ord_name}, {sizes}, {0}".format(
+            self.STATES[self.state], **self.__dict__)
 
     def to_list(self):
         tmp = [self.ord_name, self.ord_id, self.wholesale, self.CRDate]
@@ -100,34 +188,234 @@ class GetOrderDetail:
         tmp.extend(self.sizes.values())
         return tmp
 
+    def to_dict(self):
+        """
+        :return: the order as a json serializable dictionary, only the ordered sizes
+            are listed
+        :rtype: dict
+        """
+        return {'CRDate': self.CRDate, 'ord_id': self.ord_id, 'wholesale': self.wholesale,
+                'ord_name': self.ord_name, 'gender': self.gender, 'scale': self.scale,
+                'sizes': OrderedDict((size, qty) for size, qty in self.sizes.items()
+                                     if qty != '')}
+
     def header_to_list(self):
-        tmp = [None, None, None, None, None, None, None]
+        """
+        :return: the header row of the order, the size labels are in the same
+            columns as the quantities of to_list()
+        :rtype: list
+        """
+        tmp = ["Style Name", "Style/Color", "Wholesale", "CRD", None, None, None, None]
+        if self.gender != 'm':
+            tmp.extend([None, None])
         tmp.extend(self.sizes.keys())
         return tmp
 
+    def sheet_title(self):
+        """
+        :return: the title of the output sheet of the order, the orders of the same
+            scale (and gender) go to the same sheet, the unknown scales to 'Other'.
+            It may not be a valid worksheet name, see sheet_name.
+        :rtype: str
+        """
+        if self.scale is None:
+            return 'Other'
+        sizes = list(self.sizes)
+        title = '{}-{}'.format(sizes[0], sizes[-1])
+        if self.gender is not None:
+            title += ' ' + self.gender.upper()
+        return title
+
+
+def sheet_name(title, used):
+    """
+    Make a valid worksheet name of the title: the invalid characters are replaced
+    with _, and it is truncated to SHEET_NAME_LENGTH. If the name is used already
+    (the names are not case sensitive), it gets a number e.g. 'S-XL M (2)'.
+
+    :param str title: the title, see GetOrderDetail.sheet_title
+    :param set used: the lower case names of the existing sheets, the new name is
+        added to it
+
+    :return: the name of the worksheet
+    :rtype: str
+    """
+    base = SHEET_NAME_INVALID_CMP.sub('_', title)[:SHEET_NAME_LENGTH] or 'Sheet'
+    name = base
+    number = 1
+    while name.lower() in used:
+        number += 1
+        suffix = ' ({})'.format(number)
+        name = base[:SHEET_NAME_LENGTH - len(suffix)] + suffix
+    used.add(name.lower())
+    return name
 
 def write_xlsx(orders, filename='../test/out8.xlsx'):
-    wb = Workbook()
-    ws = wb.active
+    """
+    Write the orders to a write-only workbook, the rows are streamed to the file.
+    The orders are grouped to sheets by their scale (see sheet_title), and the
+    header of the sizes is written once, or again when the size layout of the
+    sheet changes (e.g. on the 'Other' sheet). The titles are made valid worksheet
+    names, see sheet_name.
+
+    :param orders: iterable of the orders, see :class:`GetOrderDetail`
+    :param str filename: Path of the xlsx file
+    """
+    wb = Workbook(write_only=True)
+    #sheet title -> [worksheet, last header]
+    sheets = {}
+    used = set()
     for order in orders:
-        ws.append(order.to_list())
+        title = order.sheet_title()
+        sheet = sheets.get(title)
+        if sheet is None:
+            sheet = sheets[title] = [wb.create_sheet(sheet_name(title, used)), None]
+        header = order.header_to_list()
+        if header != sheet[1]:
+            sheet[0].append(header)
+            sheet[1] = header
+        sheet[0].append(order.to_list())
+    if not sheets:
+        wb.create_sheet()
     wb.save(filename)
 
 
-def read_xlsx( item_class, filename):
+def read_xlsx( item_class, filename, workers=1):
+    """
+    Parse the orders of every worksheet. The rows are streamed as value tuples of
+    the first ORDER_COLUMNS cells, no cell objects are created, and the workbook is
+    closed even if the parsing fails. The worksheets are parsed independently, so
+    with more than one worker every worksheet is parsed in a separate process, which
+    opens the file on its own. The order lists are concatenated in sheet order.
+
+    :param item_class: The parser class, called with the value tuple of every row.
+        It has to be picklable (a module level class) for the worker processes.
+    :param str filename: Path of the order detail xlsx file
+    :param int workers: Number of worker processes
+
+    :return: The parsed orders in the order of the sheets and the rows
+    :rtype: list
+    """
+    if workers > 1:
+        wb = load_workbook(filename=filename, read_only=True)
+        ws_names = wb.sheetnames
+        wb.close()
+        if len(ws_names) > 1:
+            order_list = []
+            with ProcessPoolExecutor(max_workers=min(workers, len(ws_names)),
+                                     initializer=_init_worker,
+                                     initargs=(config['order_scales']['value'],)) as executor:
+                for sheet_orders in executor.map(partial(_read_sheets, item_class, filename),
+                                                 [[ws_name] for ws_name in ws_names]):
+                    order_list.extend(sheet_orders)
+            return order_list
+    return _read_sheets(item_class, filename)
+
+
+def _init_worker(scales):
+    """
+    Initializer of the worker processes, the size scales of the parent process are
+    copied over (a spawned worker starts with the default config).
+
+    :param list scales: The order_scales config value
+    """
+    config['order_scales']['value'] = scales
+
+
+def _read_sheets(item_class, filename, ws_names=None):
+    """
+    Parse the orders of the given worksheets, see read_xlsx
+
+    :param item_class: The parser class
+    :param str filename: Path of the order detail xlsx file
+    :param list ws_names: Names of the worksheets, None for every worksheet
+
+    :return: The parsed orders
+    :rtype: list
+    """
+    return list(iter_orders(filename, item_class, ws_names))
+
+
+def iter_orders(filename, item_class=GetOrderDetail, ws_names=None):
+    """
+    Generator of the orders of the worksheets. Every order is yielded as soon as
+    its last row is parsed, so only the current order is held in memory. The
+    workbook is closed when the generator is exhausted or closed.
+
+    :param str filename: Path of the order detail xlsx file
+    :param item_class: The parser class, see read_xlsx
+    :param list ws_names: Names of the worksheets, None for every worksheet
+
+    :return: generator of the orders in the order of the sheets and the rows
+    :rtype: generator of :class:`GetOrderDetail`
+    """
     wb = load_workbook(filename=filename, read_only=True)
-    ws_names = wb.get_sheet_names()
-    order_list = []
-    for ws_name in ws_names:
-        ws = wb[ws_name]
-        i = j = 0
-        item_instance = item_class()
-        for row in ws.rows:
-            tmp = item_instance(row)
-            if tmp:
-                order_list.append(tmp)
-                item_instance = item_class()
-    return order_list
+    try:
+        worksheets = wb.worksheets if ws_names is None else [wb[name] for name in ws_names]
+        for ws in worksheets:
+            item_instance = item_class()
+            for row in ws.iter_rows(max_col=ORDER_COLUMNS, values_only=True):
+                tmp = item_instance(row)
+                if tmp:
+                    yield tmp
+                    item_instance = item_class()
+    finally:
+        wb.close()
+
+
+@contextmanager
+def _open_text(out):
+    if hasattr(out, 'write'):
+        yield out
+    else:
+        with open(out, 'w', encoding='utf-8', newline='') as text_out:
+            yield text_out
+
+
+def write_csv(orders, out):
+    """
+    Stream the orders to a csv file, one row per ordered size: CRD, Style/Color,
+    Wholesale, Style Name, Gender, Size, Qty. The file is flushed after every
+    order, so the reader gets the rows immediately.
+
+    :param orders: iterable of the orders, see :class:`GetOrderDetail`
+    :param out: Path of the csv file or a text file object
+
+    :return: number of the written orders
+    :rtype: int
+    """
+    count = 0
+    with _open_text(out) as text_out:
+        writer = csv.writer(text_out)
+        writer.writerow(CSV_HEADER)
+        for order in orders:
+            head = [order.CRDate, order.ord_id, order.wholesale, order.ord_name, order.gender]
+            writer.writerows(head + [size, qty] for size, qty in order.sizes.items()
+                             if qty != '')
+            text_out.flush()
+            count += 1
+    return count
+
+
+def write_jsonl(orders, out):
+    """
+    Stream the orders to a JSON Lines file, one object per order (see
+    GetOrderDetail.to_dict). The file is flushed after every order.
+
+    :param orders: iterable of the orders, see :class:`GetOrderDetail`
+    :param out: Path of the jsonl file or a text file object
+
+    :return: number of the written orders
+    :rtype: int
+    """
+    count = 0
+    with _open_text(out) as text_out:
+        for order in orders:
+            text_out.write(dumps(order.to_dict(), ensure_ascii=False, default=str))
+            text_out.write('\n')
+            text_out.flush()
+            count += 1
+    return count
 
 
 def main():
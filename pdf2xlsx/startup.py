@@ -1,6 +1,10 @@
+import multiprocessing
 import pdf2xlsx
 from pdf2xlsx.gui import main as gui_main
 from pdf2xlsx.config import init_conf
 
-init_conf()
-gui_main()
\ No newline at end of file
+if __name__ == '__main__':
+    #The worker processes of a frozen executable start from here too
+    multiprocessing.freeze_support()
+    init_conf()
+    gui_main()
@@ -2,6 +2,8 @@
 """
 Collection of utility functions
 """
+from datetime import datetime
+from functools import lru_cache
 
 def list2row(worksheet, row, col, values, positions=None):
     """
@@ -22,3 +24,50 @@ def list2row(worksheet, row, col, values, positions=None):
         #worksheet.write(row, col+pos, val)
         worksheet.cell(row=row+1, column=col+pos+1, value=val)
     return row+1, col
+
+def list2values(values, positions=None):
+    """
+    Arrange the values into a whole row, which can be appended to a worksheet
+    (e.g. a write-only one). The positions are handled the same way as in list2row,
+    the gaps are filled up with None.
+        :param list values: List of values to put in a row
+        :param list positions: Positions for each value (otpional, if not given the
+            values will be put after each other from column 0)
+
+        :return: the values of the row
+        :rtype: list
+    """
+    if not positions or len(positions) != len(values):
+        return list(values)
+    row = [None] * (max(positions) + 1)
+    for val, pos in zip(values, positions):
+        row[pos] = val
+    return row
+
+@lru_cache(maxsize=1024)
+def parse_date(strdate):
+    """
+    Parse the dates of the invoices. There are two formats: YYYY.MM.DD and
+    DD.MM.YYYY, both of them are parsed by slicing the fixed positions. The same
+    dates repeat a lot in a batch, so the results are memoized.
+        :param str strdate: string representation of the date
+
+        :return: the parsed date
+        :rtype: datetime
+    """
+    if len(strdate) != 10:
+        raise ValueError('Invalid date: {}'.format(strdate))
+    if strdate[2] == '.':
+        return datetime(int(strdate[6:10]), int(strdate[3:5]), int(strdate[0:2]))
+    return datetime(int(strdate[0:4]), int(strdate[5:7]), int(strdate[8:10]))
+
+@lru_cache(maxsize=1024)
+def format_date(date):
+    """
+    Format the date as YYYY.MM.DD, the results are memoized
+        :param datetime date: the date to format
+
+        :return: string representation of the date
+        :rtype: str
+    """
+    return '{:04d}.{:02d}.{:02d}'.format(date.year, date.month, date.day)
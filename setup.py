@@ -62,11 +62,20 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=['PyPDF2', 'openpyxl'],
 
+    # Headless command line interface, see pdf2xlsx/cli.py
+    entry_points={
+        'console_scripts': ['pdf2xlsx=pdf2xlsx.cli:main'],
+    },
+
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
     # for example:
     # $ pip install -e .[dev,test]
     extras_require={
         'doc': ['Sphinx', 'autodoc'],
+        # Optional text extraction backends, see pdf2xlsx/backends.py
+        'pdfminer': ['pdfminer.six'],
+        'pymupdf': ['PyMuPDF'],
+        'pypdf': ['pypdf'],
     },
 )
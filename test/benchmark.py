@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the invoice extraction on synthetic corpora. Every stage
+(zip read, extractText, invo_parser, invoices2xlsx) is timed separately at several
+corpus sizes, and the pages/s, entries/s and peak RSS are reported. Every size is
+measured in a fresh process, so the peak RSS belongs to that size. The results are
+saved as json, so the runs of different versions can be compared.
+
+    python test/benchmark.py --sizes 10 100 1000 --output bench.json
+
+The parsing of the pre-extracted text can be repeated (--repeat), the best run is
+reported, so the parser changes can be compared on a noisy machine.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyPDF2 import PdfFileReader
+import pdf2xlsx
+from pdf2xlsx.config import config
+from pdf2xlsx.invoice import pdf_pages, text_parser
+from pdf2xlsx.logger import StatLogger
+from pdf2xlsx.managment import iter_zip_pdfs, invoices2xlsx, zip2xlsx
+from corpus import make_corpus
+
+
+def peak_rss_kb():
+    """
+    :return: Peak resident set size of the process in kB, None if it is unknown
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+class Timer():
+    """
+    Measure the wall and cpu time of a with block
+    """
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+        return False
+
+
+def _stage(timer, pages, entries):
+    return {'wall': timer.wall, 'cpu': timer.cpu,
+            'pages_per_s': pages / timer.wall if timer.wall else None,
+            'entries_per_s': entries / timer.wall if timer.wall else None}
+
+
+def bench_corpus(directory, invoices, pages, entries, workers, write_only, repeat=1):
+    """
+    Generate a corpus and time every stage on it
+
+    :return: the measurements
+    :rtype: dict
+    """
+    zip_path = os.path.join(directory, 'corpus_{}.zip'.format(invoices))
+    make_corpus(zip_path, invoices=invoices, pages=pages, entries=entries)
+    n_pages = invoices * pages
+    n_entries = invoices * entries
+
+    with Timer() as zip_timer:
+        pdf_list = [pdf_data for _name, pdf_data in iter_zip_pdfs(zip_path)]
+    with Timer() as text_timer:
+        texts = [list(pdf_pages(PdfFileReader(BytesIO(pdf_data)))) for pdf_data in pdf_list]
+    parse_timer = None
+    for _dummy in range(repeat):
+        logger = StatLogger()
+        with Timer() as timer:
+            invoice_list = [invo for pages_text in texts
+                            for invo in text_parser(pages_text, logger)]
+        if parse_timer is None or timer.wall < parse_timer.wall:
+            parse_timer = timer
+    with Timer() as xlsx_timer:
+        invoices2xlsx(invoice_list, directory, 'bench.xlsx', write_only=write_only)
+    del texts, invoice_list
+    with Timer() as total_timer:
+        zip2xlsx(zip_path, os.path.join(directory, 'bench_e2e.xlsx'), StatLogger(),
+                 workers=workers, write_only=write_only)
+
+    return {'invoices': invoices, 'pages': n_pages, 'entries': n_entries,
+            'bytes': sum(len(pdf_data) for pdf_data in pdf_list),
+            'parsed_entries': sum(logger.invo_list),
+            'stages': {'zip_read': _stage(zip_timer, n_pages, n_entries),
+                       'extract_text': _stage(text_timer, n_pages, n_entries),
+                       'invo_parser': _stage(parse_timer, n_pages, n_entries),
+                       'invoices2xlsx': _stage(xlsx_timer, n_pages, n_entries),
+                       'end_to_end': _stage(total_timer, n_pages, n_entries)},
+            'peak_rss_kb': None}
+
+
+def _bench_process(directory, size, args):
+    """
+    Run bench_corpus in a fresh process, see main
+
+    :return: the measurements with the peak RSS of the process
+    :rtype: dict
+    """
+    #Measure the real work, not the caches
+    config['cache_size']['value'] = 0
+    config['text_cache_size']['value'] = 0
+    result = bench_corpus(directory, size, args.pages, args.entries, args.workers,
+                          args.write_only, args.repeat)
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pdf2xlsx invoice extraction')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='number of invoices (pdf files) of the corpora')
+    parser.add_argument('--pages', type=int, default=1, help='pages per pdf')
+    parser.add_argument('--entries', type=int, default=5, help='entries per invoice')
+    parser.add_argument('--workers', type=int, default=1, help='workers of the end-to-end run')
+    parser.add_argument('--write-only', action='store_true', help='write-only xlsx output')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='parse the text this many times, the best run is reported')
+    parser.add_argument('--output', default='bench_results.json', help='json result file')
+    args = parser.parse_args()
+
+    results = []
+    #The peak RSS is a maximum over the life of the process, so every size is
+    #measured in a new one. It is spawned, so it does not inherit the memory of the
+    #previous sizes.
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(_bench_process, directory, size, args).result()
+            results.append(result)
+            print('{invoices:6d} invoices: '.format(**result) + ', '.join(
+                '{} {:.3f}s'.format(stage, value['wall'])
+                for stage, value in result['stages'].items()))
+
+    report = {'version': pdf2xlsx.__version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'arguments': vars(args),
+              'results': results}
+    with open(args.output, 'w', encoding='utf-8') as result_out:
+        result_out.write(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic invoice corpus generator. It writes minimal pdf files with the same
+text structure as the supplier invoices (SZÁMLA) and credit notes (HELYESBÍTÕ,
+VISSZÁRU), so the parser and the whole pipeline can be tested and benchmarked
+with any number of invoices, pages and entries.
+
+The order detail workbooks (Line Item blocks with size runs) are generated by
+make_order_workbook.
+"""
+import random
+import zipfile
+from datetime import date, timedelta
+from openpyxl import Workbook
+
+NAMES = ['NIKE ROSHE ONE', 'NIKE AIR MAX 90 MID WNTR', 'NIKE AIR HUARACHE',
+         'WMNS AIR HUARACHE RUN', 'W INTERNATIONALIST MID LTHR', 'JORDAN J23',
+         'AIR FORCE 1 MID (GS)', 'M NSW TCH FLC JKT ARLFT']
+UNITS = ['Pár', 'Darab']
+
+
+def _money(value):
+    """
+    Format the value with . as thousands separator, e.g. 1.018.340
+    """
+    return '{:,}'.format(value).replace(',', '.')
+
+
+def _date(value, awkward):
+    if awkward:
+        return value.strftime('%d.%m.%Y')
+    return value.strftime('%Y.%m.%d')
+
+
+def _escape(line):
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def pdf_from_pages(pages):
+    """
+    Create a minimal pdf file, every page contains the given lines of text. The
+    lines are written with the Tj and T* operators, so PyPDF2 extractText gives
+    back the lines separated by new lines.
+
+    :param list pages: list of pages, every page is a list of str lines
+
+    :return: The content of the pdf file
+    :rtype: bytes
+    """
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+               b'/Encoding /WinAnsiEncoding >>']
+    kids = []
+    for lines in pages:
+        stream = ['BT /F1 8 Tf 10 TL 20 820 Td']
+        stream.extend('({}) Tj T*'.format(_escape(line)) for line in lines)
+        stream.append('ET')
+        content = '\n'.join(stream).encode('latin-1')
+        objects.append(b''.join([b'<< /Length ', str(len(content)).encode(), b' >>\nstream\n',
+                                 content, b'\nendstream']))
+        objects.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       '/Resources << /Font << /F1 3 0 R >> >> '
+                       '/Contents {} 0 R >>'.format(len(objects)).encode())
+        kids.append('{} 0 R'.format(len(objects)))
+    objects[1] = '<< /Type /Pages /Kids [{}] /Count {} >>'.format(
+        ' '.join(kids), len(kids)).encode()
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for num, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += '{} 0 obj\n'.format(num).encode() + obj + b'\nendobj\n'
+    xref = len(out)
+    out += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(objects) + 1).encode()
+    for offset in offsets:
+        out += '{:010d} 00000 n \n'.format(offset).encode()
+    out += 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+        len(objects) + 1, xref).encode()
+    return bytes(out)
+
+
+def gen_invoice(rnd, id_no, entries=5, credit=False):
+    """
+    Generate the data of a random invoice, the values are the same as the parser
+    should give back: (type, id_no, orig_date, pay_due, total_sum, entry tuples)
+
+    :param Random rnd: random generator
+    :param int id_no: 10 digit invoice number
+    :param int entries: number of the invoice entries
+    :param bool credit: generate a credit note
+
+    :return: invoice data
+    :rtype: dict
+    """
+    orig_date = date(2016, 1, 1) + timedelta(days=rnd.randrange(700))
+    sign = -1 if credit else 1
+    entry_list = []
+    for _dummy in range(entries):
+        qty = rnd.randrange(1, 120)
+        gross = rnd.randrange(1000, 60000)
+        disc = rnd.choice([0, 10, 14, 20])
+        net = gross * (100 - disc) // 100
+        entry_list.append(('{:06d}-{:03d}'.format(rnd.randrange(10 ** 6), rnd.randrange(1000)),
+                           rnd.choice(NAMES), rnd.choice(UNITS), qty, sign * gross,
+                           disc, sign * net, sign * net * qty, rnd.choice([0, 27])))
+    return {'credit': credit,
+            'id_no': id_no,
+            'orig_date': orig_date,
+            'pay_due': orig_date + timedelta(days=60),
+            'orig_invo_no': id_no - 1000 if credit else 0,
+            'total_sum': sum(entr[7] for entr in entry_list),
+            'entries': entry_list,
+            'awkward': rnd.random() < 0.5}
+
+
+def invoice_lines(invo):
+    """
+    Lay out the invoice data to text lines, as they are extracted from the real
+    invoices
+
+    :param dict invo: invoice data, see gen_invoice
+
+    :return: header lines, list of entry line pairs and footer lines
+    :rtype: tuple of (list, list, list)
+    """
+    minus = '-' if invo['credit'] else ''
+    orig_date = _date(invo['orig_date'], invo['awkward'])
+    if invo['credit']:
+        header = ['HELYESBÍTÕ SZÁMLA' if invo['id_no'] % 2 else 'VISSZÁRU SZÁMLA',
+                  'Vevõ száma:372685',
+                  'Helyesbítõ számla sorszáma{}'.format(invo['id_no']),
+                  'Helyesbítõ számla kelte{}'.format(orig_date),
+                  'Eredeti számla sorszáma',
+                  '{}   {}'.format(invo['orig_invo_no'], orig_date)]
+    else:
+        header = ['SZÁMLA MÁSOLAT PLD.Kérjük jelezze átutaláskor!',
+                  'Vevõ száma:372685', '',
+                  'Számla sorszáma:{}'.format(invo['id_no']),
+                  'Teljesítés idõpontja:{}'.format(orig_date), '',
+                  'Számla kelte:{}'.format(orig_date), '',
+                  'Termék kódMegrendelés száma', 'Termék megnevezése ']
+    entries = []
+    for code, name, unit, qty, gross, disc, net, total, vat in invo['entries']:
+        entries.append([' {}{}{}'.format(code, name, unit),
+                        '    {}        {}{}   {}%        {}{}       {}{}    {}%'.format(
+                            qty, _money(abs(gross)), minus, disc, _money(abs(net)), minus,
+                            _money(abs(total)), minus, vat)])
+    total = _money(abs(invo['total_sum']))
+    if invo['credit']:
+        footer = ['Bruttó összesenKedvezményEgyéb összesen',
+                  'Adó részletezésAdóalapAdó %Adó összege',
+                  'Free from VAT     {}-    0%             0'.format(total)]
+    else:
+        footer = ['Bruttó összesenKedvezményEgyéb összesenNettó összesen',
+                  'FIZETÉSI HATÁRIDÕ:{}     {}'.format(
+                      _date(invo['pay_due'], invo['awkward']), total),
+                  'Fizetés módja 60 napon belülAdó részletezésAdóalapAdó %Adó összege']
+    return header, entries, footer
+
+
+def invoice_pages(invoices, pages=1):
+    """
+    Distribute the lines of the invoices to the given number of pages. An entry
+    is never split between two pages.
+
+    :param list invoices: list of invoice data, see gen_invoice
+    :param int pages: number of pages (at least 1)
+
+    :return: list of pages, every page is a list of lines
+    :rtype: list of list
+    """
+    blocks = []
+    for invo in invoices:
+        header, entries, footer = invoice_lines(invo)
+        blocks.append(header)
+        blocks.extend(entries)
+        blocks.append(footer)
+    per_page = -(-len(blocks) // max(1, pages))
+    result = []
+    for start in range(0, len(blocks), per_page):
+        result.append([line for block in blocks[start:start + per_page] for line in block])
+    while len(result) < pages:
+        result.append(['Oldal {} / {}'.format(len(result) + 1, pages)])
+    return result
+
+
+def make_corpus(path, invoices=10, pages=1, entries=5, credit_ratio=0.2, seed=0, per_pdf=1):
+    """
+    Write a zip file of invoice pdf files
+
+    :param str path: path of the zip file
+    :param int invoices: number of invoices
+    :param int pages: number of pages per pdf
+    :param int entries: number of entries per invoice
+    :param float credit_ratio: ratio of the credit notes
+    :param int seed: seed of the random generator
+    :param int per_pdf: number of invoices per pdf (batch pdf files)
+
+    :return: the generated invoice data, in the order of the zip members
+    :rtype: list of dict
+    """
+    rnd = random.Random(seed)
+    result = []
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as myzip:
+        for first in range(0, invoices, per_pdf):
+            batch = [gen_invoice(rnd, 6510000000 + i * 7, entries, rnd.random() < credit_ratio)
+                     for i in range(first, min(first + per_pdf, invoices))]
+            myzip.writestr('{}_synthetic.pdf'.format(batch[0]['id_no']),
+                           pdf_from_pages(invoice_pages(batch, pages)))
+            result.extend(batch)
+    return result
+
+
+ORDER_SCALES = [['7', '7.5', '8', '8.5', '9', '9.5', '10'], ['11C', '11.5C', '12C', '1Y'],
+                ['3C', '3.5C', '4C', '4.5C'], ['4Y', '4.5Y', '5Y', '5.5Y', '6Y']]
+
+
+def gen_order(rnd, ord_no):
+    """
+    Generate the data of a random order, the sizes are a continuous run of one scale
+
+    :param Random rnd: random generator
+    :param int ord_no: number of the order
+
+    :return: order data (CRDate, ord_id, wholesale, ord_name, list of (size, qty))
+    :rtype: dict
+    """
+    scale = rnd.choice(ORDER_SCALES)
+    start = rnd.randrange(len(scale) - 1)
+    sizes = [(size, rnd.randrange(1, 40)) for size in scale[start:rnd.randrange(start + 1,
+                                                                              len(scale) + 1)]]
+    return {'CRDate': '2017-{:02d}-{:02d}'.format(rnd.randrange(1, 13), rnd.randrange(1, 29)),
+            'ord_id': '{:06d}-{:03d}'.format(ord_no, rnd.randrange(1000)),
+            'wholesale': rnd.randrange(5000, 40000),
+            'ord_name': rnd.choice(NAMES),
+            'sizes': sizes}
+
+
+def order_rows(order):
+    """
+    Lay out the order data to the rows of an order detail sheet
+
+    :param dict order: order data, see gen_order
+
+    :return: list of rows
+    :rtype: list of list
+    """
+    rows = [['Line Item:', 1, None, 'CRD:', order['CRDate']],
+            ['Style/Color:', order['ord_id'], None, None, None, None, 'Wholesale:',
+             order['wholesale']],
+            ['Style Name:', order['ord_name']],
+            [],
+            ['Size', None, 'Qty']]
+    rows.extend([size, None, qty] for size, qty in order['sizes'])
+    rows.append(['Total Qty:', None, sum(qty for _size, qty in order['sizes'])])
+    rows.append([])
+    return rows
+
+
+def make_order_workbook(path, orders=10, sheets=1, seed=0):
+    """
+    Write an order detail xlsx file, the orders are distributed over the sheets
+
+    :param str path: path of the xlsx file
+    :param int orders: number of orders
+    :param int sheets: number of worksheets
+    :param int seed: seed of the random generator
+
+    :return: the generated order data, in the order of the sheets and rows
+    :rtype: list of dict
+    """
+    rnd = random.Random(seed)
+    result = [gen_order(rnd, ord_no) for ord_no in range(orders)]
+    workbook = Workbook(write_only=True)
+    per_sheet = -(-orders // sheets)
+    for start in range(0, orders, per_sheet):
+        worksheet = workbook.create_sheet()
+        for order in result[start:start + per_sheet]:
+            for row in order_rows(order):
+                worksheet.append(row)
+    workbook.save(path)
+    return result
@@ -1,14 +1,653 @@
 # -*- coding: utf-8 -*-
 import pytest
+import copy
+import csv
+import hashlib
+import json
 import os
-import pdf2xlsx.pdf2xlsx
+import random
+import time
+import zipfile
+from collections import OrderedDict
+from datetime import datetime, time as day_time
+import pdf2xlsx
+import pdf2xlsx.cache
+import pdf2xlsx.cli
+import pdf2xlsx.invoice
+import pdf2xlsx.managment
+from pdf2xlsx.cache import TextCache, clear_cache, get_invoice_cache
+from pdf2xlsx.backends import compare_backends
+from pdf2xlsx.config import config
+from pdf2xlsx.invoice import (CreditEntry, CreditInvoice, Entry, EntryColumns, EntryTuple,
+                             LineClassifier, ParseError, clear_me_units, first_chars,
+                             register_invoice_type, text_parser)
+from pdf2xlsx.logger import StatLogger
+from pdf2xlsx.manifest import Manifest
+from openpyxl import Workbook, load_workbook
+from pdf2xlsx.managment import (iter_zip_pdfs, iter_invoices, iter_pdf_sources, invoices2xlsx,
+                                 pdfs2xlsx)
+from pdf2xlsx.utility import parse_date
+from pdf2xlsx.order_detail_xlsx_parse import (GetOrderDetail, read_xlsx, write_xlsx, StateError,
+                                              iter_orders, write_csv, write_jsonl, sheet_name)
+from corpus import make_corpus, pdf_from_pages, gen_invoice, invoice_lines, make_order_workbook
 
 
-def test_simple_run():
-    pdf2xlsx.do_it(os.path.join('test','src.zip'), 'test')
-    with open(os.path.join('test','Invoices.xlsx'), 'rb') as fd:
-        content1 = fd.read()
-    with open(os.path.join('test','Invoices01.xlsx'), 'rb') as fd:
-        content2 = fd.read()
-    
-    assert content1 == content2
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setitem(config['cache_size'], 'value', 0)
+    monkeypatch.setitem(config['text_cache_size'], 'value', 0)
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setitem(config['cache_dir'], 'value', str(tmpdir.join('cache')))
+    monkeypatch.setitem(config['cache_size'], 'value', 1)
+    monkeypatch.setitem(config['text_cache_size'], 'value', 1)
+    return tmpdir.join('cache')
+
+
+def _sheet_values(xlsx_path):
+    workbook = load_workbook(xlsx_path, read_only=True)
+    values = [list(worksheet.values) for worksheet in workbook.worksheets]
+    workbook.close()
+    return values
+
+
+def test_simple_run(tmpdir, no_cache, monkeypatch):
+    opened = []
+    monkeypatch.setattr(pdf2xlsx.managment, 'run_excel', opened.append)
+    pdf2xlsx.do_it(os.path.join('test', 'src.zip'), str(tmpdir))
+
+    assert opened == [str(tmpdir.join('Invoices01.xlsx'))]
+    #The reference file only has the invoice sheet
+    assert _sheet_values(str(tmpdir.join('Invoices01.xlsx')))[0] == \
+        _sheet_values(os.path.join('test', 'Invoices.xlsx'))[0]
+
+
+@pytest.mark.parametrize('compact, per_pdf', [(0, 1), (1, 1), (1, 5)])
+def test_synthetic_corpus(tmpdir, no_cache, monkeypatch, compact, per_pdf):
+    monkeypatch.setitem(config['compact_entries'], 'value', compact)
+    zip_path = str(tmpdir.join('corpus.zip'))
+    expected = make_corpus(zip_path, invoices=12, pages=2, entries=4, credit_ratio=0.5,
+                           per_pdf=per_pdf)
+    logger = StatLogger()
+    invoices = list(iter_invoices((pdf_data for _name, pdf_data in iter_zip_pdfs(zip_path)),
+                                  logger))
+
+    assert [invo.id_no for invo in invoices] == [invo['id_no'] for invo in expected]
+    assert [invo.total_sum for invo in invoices] == [invo['total_sum'] for invo in expected]
+    assert [[tuple(entr.entry_tuple) for entr in invo.entries] for invo in invoices] == \
+        [invo['entries'] for invo in expected]
+    assert logger.invo_list == [4] * 12
+
+
+def test_entry_columns_code_width():
+    tuples = [EntryTuple('AB1234-567', 'TEE', 'DB', 1, 100, 0, 100, 100, 27),
+              EntryTuple('AB1234-5678', 'TEE', 'DB', 2, 100, 10, 90, 180, 27),
+              EntryTuple('ÁB1234-567', 'CAP', 'PÁR', 1, 50, 0, 50, 50, 27)]
+    columns = EntryColumns()
+    columns.append(Entry(entry_tuple=tuples[0]))
+    assert isinstance(columns.codes, bytearray)
+    #The codes which do not fit the width are kept, they are not packed anymore
+    for entry_tuple in tuples[1:]:
+        columns.append(Entry(entry_tuple=entry_tuple))
+    assert [row.entry_tuple for row in columns] == tuples
+    unpacked = EntryColumns(code_width=None)
+    for entry_tuple in tuples:
+        unpacked.append(Entry(entry_tuple=entry_tuple))
+    assert [row.entry_tuple for row in unpacked] == tuples
+
+
+def test_cache_hit_counts_pages(cache_dir):
+    invo = gen_invoice(random.Random(5), 6510000000, entries=4)
+    header, entries, footer = invoice_lines(invo)
+    lines = header + [line for entry in entries for line in entry] + footer
+    pdf_data = pdf_from_pages([lines[:10], lines[10:]])
+    loggers = [StatLogger(), StatLogger()]
+    for logger in loggers:
+        list(iter_invoices([pdf_data], logger))
+
+    assert [logger.pdfs[0]['source'] for logger in loggers] == ['pdf', 'invoice_cache']
+    assert loggers[1].counters == loggers[0].counters
+    assert loggers[1].counters['pages'] == 2
+
+
+@pytest.mark.parametrize('tail', ['0%', '0% x', '   0%    x 12', '0%x'])
+def test_entry_trailing_tokens(tail):
+    entry_tuple = Entry().line2entry(
+        '511881-026 NIKE ROSHE ONE Pár 23 13.495 14% 11.605 266.915 ' + tail)
+    assert tuple(entry_tuple) == ('511881-026', ' NIKE ROSHE ONE ', 'Pár', 23, 13495, 14,
+                                  11605, 266915, 0)
+
+
+def test_entry_trailing_tokens_linear():
+    def best_time(tokens):
+        line = '511881-026 NIKE Pár 23 13.495 14% 11.605 266.915' + ' x' * tokens
+        times = []
+        for _dummy in range(2):
+            start = time.perf_counter()
+            with pytest.raises(ParseError):
+                Entry().line2entry(line)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    #Four times longer line, a quadratic trimming takes about 16 times longer
+    assert best_time(160000) < 8 * best_time(40000)
+
+
+def test_me_units_cached(request, monkeypatch):
+    request.addfinalizer(clear_me_units)
+    line = '511881-026 NIKE TEE Csomag 2 10 0% 10 20 27%'
+    clear_me_units()
+    with pytest.raises(ParseError):
+        Entry().line2entry(line)
+    #The units are read from the config again only when the config is accepted
+    monkeypatch.setitem(config['ME'], 'value', ['Pár', 'Csomag'])
+    with pytest.raises(ParseError):
+        Entry().line2entry(line)
+    clear_me_units()
+    assert Entry().line2entry(line).ME == 'Csomag'
+
+
+def test_entry_pattern_mismatch():
+    with pytest.raises(ParseError):
+        Entry().line2entry('511881-026 NIKE ROSHE ONE Pár 23 13.495 14% 11.605 266.915')
+
+
+def _sources(loggers):
+    return [logger.pdfs[0]['source'] for logger in loggers]
+
+
+def test_invoice_cache_hit_and_miss(cache_dir, monkeypatch):
+    pdf_data = _invoice_pdf(*invoice_lines(gen_invoice(random.Random(7), 6510000000,
+                                                       entries=3)))
+    loggers = [StatLogger() for _dummy in range(4)]
+    results = [list(iter_invoices([pdf_data], loggers[0])),
+               list(iter_invoices([pdf_data], loggers[1]))]
+    #The parser changed: the invoices are parsed again from the cached text
+    monkeypatch.setattr(pdf2xlsx.cache, 'CACHE_VERSION', -1)
+    results.append(list(iter_invoices([pdf_data], loggers[2])))
+    clear_cache()
+    results.append(list(iter_invoices([pdf_data], loggers[3])))
+
+    assert _sources(loggers) == ['pdf', 'invoice_cache', 'text_cache', 'pdf']
+    assert len(set(repr([tuple(entr.entry_tuple) for entr in result[0].entries])
+                   for result in results)) == 1
+    assert cache_dir.join('invoices').listdir() and cache_dir.join('text').listdir()
+
+
+def test_invoice_cache_key_invoice_types(cache_dir, monkeypatch):
+    monkeypatch.setattr(pdf2xlsx.invoice, '_INVOICE_TYPES',
+                        copy.deepcopy(pdf2xlsx.invoice._INVOICE_TYPES))
+    monkeypatch.setattr(pdf2xlsx.invoice, '_TITLE_PATTERN', [None])
+    cache = get_invoice_cache()
+    key = cache.key(b'pdf')
+    #The parse result of a document may change with a new invoice type
+    register_invoice_type(['SZÁMLA MÁSOLAT'], CreditInvoice, CreditEntry)
+    assert cache.key(b'pdf') != key
+
+
+def test_invoice_cache_atomic_store(cache_dir):
+    cache = get_invoice_cache()
+    invo = gen_invoice(random.Random(8), 6510000000, entries=1)
+    with cache.store('unfinished') as writer:
+        writer.add(invo)
+    with pytest.raises(ValueError):
+        with cache.store('failed') as writer:
+            writer.add(invo)
+            raise ValueError()
+    with cache.store('finished') as writer:
+        writer.add(invo)
+        writer.finish([1], 1)
+
+    assert [path.basename for path in cache_dir.join('invoices').listdir()] == ['finished']
+    logger = StatLogger()
+    assert list(cache.load('finished', logger)) == [invo]
+    assert cache.load('unfinished', logger) is None
+    assert (logger.invo_list, logger.counters['pages']) == ([1], 1)
+
+
+def test_cache_lru_eviction(tmpdir):
+    cache = TextCache(str(tmpdir), 10 ** 6)
+    keys = ['a', 'b', 'c']
+    for mtime, key in enumerate(keys, 1):
+        list(cache.record(key, ['page {} '.format(key) * 100]))
+        os.utime(str(tmpdir.join(key)), (mtime, mtime))
+    sizes = {key: tmpdir.join(key).size() for key in keys}
+    #A hit makes the oldest file the most recently used one
+    assert cache.load('a') == ['page a ' * 100]
+    cache.max_size = (sum(sizes.values()) - sizes['b'] / 2) / 0.9
+    cache.evict()
+
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['a', 'c']
+    assert cache.size() == sizes['a'] + sizes['c']
+
+
+def test_write_only_same_as_in_memory(tmpdir, no_cache):
+    zip_path = str(tmpdir.join('corpus.zip'))
+    make_corpus(zip_path, invoices=6, entries=3, credit_ratio=0.5)
+    invoices = list(iter_invoices((pdf_data for _name, pdf_data in iter_zip_pdfs(zip_path)),
+                                  StatLogger()))
+    rejects = [{'path': 'bad.pdf', 'page': None, 'line': None, 'reason': 'broken'}]
+    for write_only in (False, True):
+        invoices2xlsx(iter(invoices), str(tmpdir), 'out{:d}.xlsx'.format(write_only),
+                      write_only=write_only, rejects=rejects)
+    paths = [str(tmpdir.join('out{:d}.xlsx'.format(write_only))) for write_only in (0, 1)]
+
+    assert _sheet_values(paths[0]) == _sheet_values(paths[1])
+    assert len(_sheet_values(paths[1])[0]) == 7
+    widths = []
+    for path in paths:
+        workbook = load_workbook(path)
+        widths.append(workbook.worksheets[0].column_dimensions['B'].width)
+    assert widths == [15, 15]
+
+
+@pytest.mark.parametrize('strdate', ['2016.11.07', '07.11.2016'])
+def test_parse_date(strdate):
+    assert parse_date(strdate) == datetime(2016, 11, 7)
+
+
+def test_parse_date_invalid():
+    with pytest.raises(ValueError):
+        parse_date('2016.1.7')
+
+
+def test_cli_invoices(tmpdir, no_cache, monkeypatch):
+    monkeypatch.setattr(pdf2xlsx.cli, 'init_conf', lambda: None)
+    monkeypatch.setitem(config['excel_dates'], 'value', 0)
+    zip_path = str(tmpdir.join('corpus.zip'))
+    expected = make_corpus(zip_path, invoices=4, entries=2)
+    xlsx_path = str(tmpdir.join('out', 'invoices.xlsx'))
+    report_path = str(tmpdir.join('report.json'))
+    assert pdf2xlsx.cli.main(['-o', xlsx_path, '-j', '1', '--excel-dates',
+                              '--report', report_path, zip_path]) == 0
+
+    rows = _sheet_values(xlsx_path)[0][1:]
+    assert [row[1:] for row in rows] == \
+        [(invo['id_no'], datetime.combine(invo['orig_date'], day_time()),
+          datetime.combine(invo['pay_due'], day_time()), invo['total_sum']) for invo in expected]
+    with open(report_path, encoding='utf-8') as report_in:
+        report = json.load(report_in)
+    assert report['counters']['invoices'] == 4
+    assert report['invo_list'] == [2] * 4
+
+
+def test_cli_orders(tmpdir, monkeypatch):
+    monkeypatch.setattr(pdf2xlsx.cli, 'init_conf', lambda: None)
+    src_path = str(tmpdir.join('orders.xlsx'))
+    expected = make_order_workbook(src_path, orders=5)
+    jsonl_path = str(tmpdir.join('orders.jsonl'))
+    assert pdf2xlsx.cli.main(['--mode', 'order', '-o', jsonl_path, src_path]) == 0
+    with open(jsonl_path, encoding='utf-8') as jsonl_in:
+        assert len(jsonl_in.readlines()) == len(expected)
+    with pytest.raises(SystemExit):
+        pdf2xlsx.cli.main([])
+
+
+def test_compare_backends(tmpdir, no_cache):
+    zip_path = str(tmpdir.join('corpus.zip'))
+    make_corpus(zip_path, invoices=3, entries=2)
+    sources = list(iter_zip_pdfs(zip_path)) + [('broken.pdf', b'%PDF-1.4 truncated')]
+    results = compare_backends(sources, ['pypdf2'])
+
+    result = results['pypdf2']
+    assert (result['pdfs'], result['invoices'], result['entries']) == (4, 3, 6)
+    assert (result['errors'], result['same'], result['rejected']) == (1, 3, 0)
+    assert 0 < result['parsed'] <= result['lines']
+    with pytest.raises(ValueError):
+        compare_backends(sources, ['unknown'])
+
+
+def test_unknown_document_skipped(tmpdir, no_cache):
+    pdf_data = pdf_from_pages([['DELIVERY NOTE', 'Számla sorszáma:6510000000'],
+                               ['SZÁMLA MÁSOLAT PLD.']])
+    logger = StatLogger()
+    assert list(iter_invoices([pdf_data], logger)) == []
+    assert logger.counters['unknown'] == 1
+    assert logger.counters['pages'] == 1
+
+
+def test_split_pages(no_cache, monkeypatch):
+    monkeypatch.setitem(config['split_pages'], 'value', 4)
+    invo = gen_invoice(random.Random(1), 6510000000, entries=12)
+    header, entries, footer = invoice_lines(invo)
+    lines = header + [line for entry in entries for line in entry] + footer
+    #Three lines per page, so some entries are split between two pages
+    pdf_data = pdf_from_pages([lines[i:i + 3] for i in range(0, len(lines), 3)])
+    for workers in (1, 3):
+        invoices = list(iter_invoices([pdf_data], StatLogger(), workers))
+        assert [tuple(entr.entry_tuple) for entr in invoices[0].entries] == invo['entries']
+
+
+def test_split_pages_between_small_pdfs(no_cache, monkeypatch):
+    monkeypatch.setitem(config['split_pages'], 'value', 4)
+    rnd = random.Random(6)
+    sources = []
+    for id_no, pages in [(6510000000, 1), (6510000007, 6), (6510000014, 1)]:
+        header, entries, footer = invoice_lines(gen_invoice(rnd, id_no, entries=6))
+        lines = header + [line for entry in entries for line in entry] + footer
+        step = -(-len(lines) // pages)
+        sources.append(pdf_from_pages([lines[i:i + step] for i in range(0, len(lines), step)]))
+    #The pool of the pdf files is stopped for the large pdf and started again
+    results = [[(invo.id_no, [tuple(entr.entry_tuple) for entr in invo.entries])
+                for invo in iter_invoices(sources, StatLogger(), workers)]
+               for workers in (1, 2)]
+    assert results[0] == results[1]
+    assert [id_no for id_no, _entries in results[1]] == [6510000000, 6510000007, 6510000014]
+
+
+def test_split_pages_by_page_count(no_cache, monkeypatch):
+    monkeypatch.setitem(config['split_pages'], 'value', 4)
+    #Every pdf is big enough in bytes, but has only one page
+    monkeypatch.setattr(pdf2xlsx.managment, '_MIN_PAGE_BYTES', 1)
+    created = []
+    pool_cls = pdf2xlsx.managment.ProcessPoolExecutor
+
+    def counting_pool(*args, **kwargs):
+        created.append(kwargs['initializer'])
+        return pool_cls(*args, **kwargs)
+    monkeypatch.setattr(pdf2xlsx.managment, 'ProcessPoolExecutor', counting_pool)
+
+    rnd = random.Random(8)
+    invos = [gen_invoice(rnd, 6510000000 + 7 * i, entries=2) for i in range(4)]
+    sources = [_invoice_pdf(*invoice_lines(invo)) for invo in invos]
+    invoices = list(iter_invoices(sources, StatLogger(), 2))
+    assert [invo.id_no for invo in invoices] == [invo['id_no'] for invo in invos]
+    #The one page pdf files are not split, the pool of the pdf files is not restarted
+    assert created == [pdf2xlsx.managment._init_worker]
+
+
+def _invoice_pdf(header, entries, footer):
+    return pdf_from_pages([header + [line for entry in entries for line in entry] + footer])
+
+
+def test_tolerant_rejects(tmpdir, no_cache, monkeypatch):
+    monkeypatch.setitem(config['tolerant'], 'value', 1)
+    rnd = random.Random(2)
+    good = gen_invoice(rnd, 6510000000, entries=3)
+    header, entries, footer = invoice_lines(gen_invoice(rnd, 6510000007, entries=3))
+    entries[1][1] = '    garbage'
+    sources = [('good.pdf', _invoice_pdf(*invoice_lines(good))),
+               ('broken.pdf', b'%PDF-1.4 truncated'),
+               ('bad_line.pdf', _invoice_pdf(header, entries, footer))]
+    xlsx_path = str(tmpdir.join('tolerant.xlsx'))
+    logger = StatLogger()
+    pdfs2xlsx(sources, xlsx_path, logger, workers=1)
+
+    assert logger.invo_list == [3, 2]
+    assert [(rej['path'], rej['page']) for rej in logger.rejects] == \
+        [('broken.pdf', None), ('bad_line.pdf', 1)]
+    assert logger.rejects[1]['line'].endswith('garbage')
+    workbook = load_workbook(xlsx_path, read_only=True)
+    rows = list(workbook['rejects'].values)
+    workbook.close()
+    assert rows[0] == ('Path', 'Page', 'Line', 'Reason')
+    assert len(rows) == 3
+
+
+def test_incremental_append(tmpdir, no_cache):
+    rnd = random.Random(9)
+    invoices = [gen_invoice(rnd, 6510000000 + 7 * i, entries=2) for i in range(3)]
+    pdfs = [('{}.pdf'.format(i), _invoice_pdf(*invoice_lines(invo)))
+            for i, invo in enumerate(invoices)]
+    xlsx_path = str(tmpdir.join('append.xlsx'))
+    pdfs2xlsx(pdfs[:2], xlsx_path, StatLogger(), workers=1, incremental=True)
+    logger = StatLogger()
+    pdfs2xlsx(pdfs, xlsx_path, logger, workers=1, incremental=True)
+
+    assert logger.invo_list == [2]
+    assert [row[1] for row in _sheet_values(xlsx_path)[0][1:]] == \
+        [invo['id_no'] for invo in invoices]
+    manifest = Manifest(xlsx_path)
+    assert manifest.invoices == set(invo['id_no'] for invo in invoices)
+    assert len(manifest.pdfs) == 3
+
+
+def test_manifest_from_xlsx(tmpdir, no_cache):
+    rnd = random.Random(10)
+    invoices = [gen_invoice(rnd, 6510000000 + 7 * i, entries=1) for i in range(2)]
+    xlsx_path = str(tmpdir.join('seed.xlsx'))
+    pdfs2xlsx([('0.pdf', _invoice_pdf(*invoice_lines(invoices[0])))], xlsx_path,
+              StatLogger(), workers=1)
+    #No manifest yet, the written invoice numbers are read from the invoice sheet
+    manifest = Manifest(xlsx_path)
+    assert manifest.invoices == {invoices[0]['id_no']}
+
+    #The same invoice in an other pdf is not written again
+    header, entries, footer = invoice_lines(invoices[0])
+    pdfs = [('copy.pdf', pdf_from_pages([header + [line for entry in entries
+                                                   for line in entry] + footer, []])),
+            ('1.pdf', _invoice_pdf(*invoice_lines(invoices[1])))]
+    logger = StatLogger()
+    pdfs2xlsx(pdfs, xlsx_path, logger, workers=1, incremental=True)
+    assert logger.invo_list == [1, 1]
+    assert [row[1] for row in _sheet_values(xlsx_path)[0][1:]] == \
+        [invo['id_no'] for invo in invoices]
+
+
+def test_manifest_forget_pdfs(tmpdir):
+    xlsx_path = tmpdir.join('out.xlsx')
+    Workbook().save(str(xlsx_path))
+    manifest = Manifest(str(xlsx_path))
+    pdfs = [('a.pdf', b'a'), ('b.pdf', b'b')]
+    assert list(manifest.new_pdfs(pdfs)) == pdfs
+    manifest.forget_pdfs(['a.pdf', 'unknown.pdf'])
+    assert list(manifest.new_pdfs(pdfs + [('b2.pdf', b'b')])) == [('a.pdf', b'a')]
+    manifest.store()
+
+    assert Manifest(str(xlsx_path)).pdfs == manifest.pdfs and len(manifest.pdfs) == 2
+
+
+def test_incremental_retry_rejected(tmpdir, no_cache, monkeypatch):
+    monkeypatch.setitem(config['tolerant'], 'value', 1)
+    rnd = random.Random(3)
+    good = gen_invoice(rnd, 6510000000, entries=2)
+    fixed = gen_invoice(rnd, 6510000007, entries=3)
+    header, entries, footer = invoice_lines(fixed)
+    entries[1][1] = '    garbage'
+    xlsx_path = str(tmpdir.join('retry.xlsx'))
+    pdfs2xlsx([('good.pdf', _invoice_pdf(*invoice_lines(good))),
+               ('bad_line.pdf', _invoice_pdf(header, entries, footer))],
+              xlsx_path, StatLogger(), workers=1, incremental=True)
+    #The rejected pdf is processed again as a whole
+    logger = StatLogger()
+    pdfs2xlsx([('good.pdf', _invoice_pdf(*invoice_lines(good))),
+               ('bad_line.pdf', _invoice_pdf(*invoice_lines(fixed)))],
+              xlsx_path, logger, workers=1, incremental=True)
+
+    assert logger.invo_list == [3]
+    rows = _sheet_values(xlsx_path)[1][1:]
+    assert [row[0] for row in rows] == [6510000000] * 2 + [6510000007] * 3
+
+
+def test_incremental_same_member_names(tmpdir, no_cache, monkeypatch):
+    monkeypatch.setitem(config['tolerant'], 'value', 1)
+    rnd = random.Random(9)
+    good = _invoice_pdf(*invoice_lines(gen_invoice(rnd, 6510000000, entries=2)))
+    header, entries, footer = invoice_lines(gen_invoice(rnd, 6510000007, entries=2))
+    entries[0][1] = '    garbage'
+    zip_paths = []
+    for day, pdf_data in (('day1', _invoice_pdf(header, entries, footer)), ('day2', good)):
+        zip_paths.append(str(tmpdir.join(day + '.zip')))
+        with zipfile.ZipFile(zip_paths[-1], 'w') as zip_out:
+            zip_out.writestr('invoice.pdf', pdf_data)
+    xlsx_path = str(tmpdir.join('days.xlsx'))
+    logger = StatLogger()
+    pdfs2xlsx(iter_pdf_sources(zip_paths), xlsx_path, logger, workers=1, incremental=True)
+
+    assert [reject['path'] for reject in logger.rejects] == [zip_paths[0] + '/invoice.pdf']
+    #Only the rejected member is forgotten, the good one with the same name is kept
+    assert Manifest(xlsx_path).pdfs == {hashlib.sha256(good).hexdigest()}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_read_order_details(tmpdir, workers):
+    xlsx_path = str(tmpdir.join('orders.xlsx'))
+    expected = make_order_workbook(xlsx_path, orders=9, sheets=3)
+    orders = read_xlsx(GetOrderDetail, xlsx_path, workers)
+
+    assert [(order.CRDate, order.ord_id, order.wholesale, order.ord_name)
+            for order in orders] == \
+        [(order['CRDate'], order['ord_id'], order['wholesale'], order['ord_name'])
+         for order in expected]
+    assert [[(size, qty) for size, qty in order.sizes.items() if qty != '']
+            for order in orders] == [order['sizes'] for order in expected]
+
+
+def test_order_scales_config(monkeypatch):
+    monkeypatch.setitem(config['order_scales'], 'value', [['S', 'M', 'L'], ['7', '8']])
+    order = GetOrderDetail()
+    rows = [('Line Item:', 1, None, 'CRD:', '2017-01-02'),
+            ('Style/Color:', '123456-001', None, None, None, None, 'Wholesale:', 9900),
+            ('Style Name:', 'NIKE TEE'), ('Size', None, 'Qty'),
+            ('M', None, 3), ('L', None, 1), ('Total Qty:', None, 4)]
+    assert [order(row) for row in rows][-1] is order
+    assert order.scale == 0 and order.gender == 'm'
+    assert list(order.sizes.items()) == [('S', ''), ('M', 3), ('L', 1)]
+    order.state = 'SIZE'
+    with pytest.raises(StateError):
+        order(rows[-1])
+
+
+def test_order_scales_changed_in_place(monkeypatch):
+    scales = [['S', 'M', 'L']]
+    monkeypatch.setitem(config['order_scales'], 'value', scales)
+    assert GetOrderDetail(ord_name='TEE').gen_scale('M') == \
+        OrderedDict([('S', ''), ('M', ''), ('L', '')])
+    #The same list is updated, e.g. by the gui, the new sizes are found
+    scales[0].append('XL')
+    assert GetOrderDetail(ord_name='TEE').gen_scale('M') == \
+        OrderedDict([('S', ''), ('M', ''), ('L', ''), ('XL', '')])
+
+
+def test_write_orders_by_scale(tmpdir):
+    src_path = str(tmpdir.join('orders.xlsx'))
+    make_order_workbook(src_path, orders=30)
+    orders = read_xlsx(GetOrderDetail, src_path)
+    out_path = str(tmpdir.join('out.xlsx'))
+    write_xlsx(iter(orders), out_path)
+
+    workbook = load_workbook(out_path, read_only=True)
+    sheets = {ws.title: list(ws.values) for ws in workbook.worksheets}
+    workbook.close()
+    assert sorted(sheets) == sorted(set(order.sheet_title() for order in orders))
+    for title, rows in sheets.items():
+        sheet_orders = [order for order in orders if order.sheet_title() == title]
+        assert rows[0] == tuple(sheet_orders[0].header_to_list())
+        assert len(rows) == len(sheet_orders) + 1
+        header = rows[0]
+        for row, order in zip(rows[1:], sheet_orders):
+            assert {header[col]: row[col] for col in range(8, len(row))
+                    if row[col] not in (None, '')} == \
+                {size: qty for size, qty in order.sizes.items() if qty != ''}
+
+
+def test_sheet_names(tmpdir, monkeypatch):
+    used = set()
+    assert sheet_name('S/M-L:XL [x]? *', used) == 'S_M-L_XL _x__ _'
+    assert sheet_name('s/m-l:xl [X]? *', used) == 's_m-l_xl _X__ _ (2)'
+    assert sheet_name('A' * 40, used) == 'A' * 31
+    assert sheet_name('A' * 35, used) == 'A' * 27 + ' (2)'
+
+    monkeypatch.setitem(config['order_scales'], 'value', [['XS/S', 'M:L'], ['xs/s', 'm:l M']])
+    orders = []
+    for sizes in (['XS/S', 'M:L'], ['xs/s', 'm:l M']):
+        order = GetOrderDetail()
+        rows = [('Line Item:', 1, None, 'CRD:', '2017-01-02'),
+                ('Style/Color:', '123456-001', None, None, None, None, 'Wholesale:', 9900),
+                ('Style Name:', 'NIKE TEE'), ('Size', None, 'Qty')] + \
+            [(size, None, 1) for size in sizes] + [('Total Qty:', None, 2)]
+        for row in rows:
+            order(row)
+        orders.append(order)
+    out_path = str(tmpdir.join('out.xlsx'))
+    write_xlsx(iter(orders), out_path)
+    workbook = load_workbook(out_path, read_only=True)
+    titles = workbook.sheetnames
+    workbook.close()
+    #'XS/S-M:L M' and 'xs/s-m:l M' are the same sheet name
+    assert titles == ['XS_S-M_L M', 'xs_s-m_l M (2)']
+
+
+def test_stream_orders(tmpdir):
+    src_path = str(tmpdir.join('orders.xlsx'))
+    expected = make_order_workbook(src_path, orders=12, sheets=2)
+    orders = iter_orders(src_path)
+    first = next(orders)
+    assert first.ord_id == expected[0]['ord_id']
+
+    jsonl_path = str(tmpdir.join('orders.jsonl'))
+    assert write_jsonl(orders, jsonl_path) == 11
+    with open(jsonl_path, encoding='utf-8') as jsonl_in:
+        records = [json.loads(line) for line in jsonl_in]
+    assert [list(map(tuple, record['sizes'].items())) for record in records] == \
+        [order['sizes'] for order in expected[1:]]
+
+    csv_path = str(tmpdir.join('orders.csv'))
+    assert write_csv(iter_orders(src_path), csv_path) == 12
+    with open(csv_path, encoding='utf-8', newline='') as csv_in:
+        rows = list(csv.reader(csv_in))
+    assert rows[0] == ['CRD', 'Style/Color', 'Wholesale', 'Style Name', 'Gender', 'Size', 'Qty']
+    assert len(rows) == 1 + sum(len(order['sizes']) for order in expected)
+
+
+def test_profile_regex_same_result():
+    rnd = random.Random(4)
+    texts = []
+    for i in range(4):
+        header, entries, footer = invoice_lines(gen_invoice(rnd, 6510000000 + 7 * i,
+                                                            entries=5, credit=i % 2))
+        texts.append('\n'.join(header + [line for entry in entries for line in entry] + footer))
+    plain = [(invo.id_no, [tuple(entr.entry_tuple) for entr in invo.entries])
+             for invo in text_parser(texts, StatLogger())]
+    logger = StatLogger(profile_regex=True)
+    profiled = [(invo.id_no, [tuple(entr.entry_tuple) for entr in invo.entries])
+                for invo in text_parser(texts, logger)]
+
+    assert profiled == plain and len(plain) == 4
+    assert logger.regex['Entry.parse_line']['matches'] == 20
+    #The lines which can not match are gated out before the regex
+    assert 0 < logger.regex['LineClassifier.match']['calls'] < \
+        sum(text.count('\n') + 1 for text in texts)
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('[ ]*Számla sorszáma:([0-9]{10})', (frozenset('S'), True)),
+    ('(?P<kod>[A-C]{2})', (frozenset('ABC'), False)),
+    (r'\.a', (frozenset('.'), False)),
+    ('[ ]*x(y|z)', (frozenset('x'), True)),
+    ('a|b', None),
+    ('(a|b)c', None),
+    ('x?y', None),
+    ('.*?a', None),
+    ('(?!a)b', None),
+    ('[^a]b', None),
+])
+def test_first_chars(pattern, expected):
+    assert first_chars(pattern) == expected
+
+
+def test_line_gate_sound():
+    rnd = random.Random(6)
+    texts = []
+    for i in range(6):
+        header, entries, footer = invoice_lines(gen_invoice(rnd, 6520000000 + 7 * i,
+                                                            entries=4, credit=i % 2))
+        texts.append('\n'.join(header + [line for entry in entries for line in entry] + footer))
+    assert len(list(text_parser(texts, StatLogger()))) == 6
+
+    rules = [rule for classifier in LineClassifier._classifiers.values()
+             for rule in classifier._rules.values()]
+    rules.extend(LineClassifier._title_rules.values())
+    lines = [line for text in texts for line in text.split('\n')]
+    gated = 0
+    for rule in rules:
+        if rule.first is None:
+            continue
+        for line in lines:
+            char = line[:1]
+            passed = char in rule.first or \
+                char == ' ' and line.lstrip(' ')[:1] in rule.spaced
+            assert passed or rule.match(line) is None
+            gated += not passed
+    assert gated